@@ -0,0 +1,93 @@
+"""Helpers shared by the benchmarks."""
+import argparse
+import json
+import os
+import platform
+import sys
+from datetime import datetime
+from statistics import mean, median
+from time import perf_counter
+
+# `habit_tracker.config` reads the production settings from the environment when it's imported, so
+# benchmarks set placeholders for any that are missing. They are never used to connect to anything.
+PLACEHOLDER_ENV = {"ATLAS_USER": "benchmark", "ATLAS_PASS": "benchmark", "SECRET_KEY": "benchmark"}
+
+
+def set_placeholder_env(env=os.environ):
+    """Set placeholders for the environment variables required to import the app's config"""
+    for name, value in PLACEHOLDER_ENV.items():
+        env.setdefault(name, value)
+    return env
+
+
+def create_benchmark_app():
+    """Create the app with the benchmark config, which uses an in-memory mongomock database"""
+    set_placeholder_env()
+    from habit_tracker import create_app
+    return create_app("benchmark")
+
+
+def time_calls(func, repeat, setup=None):
+    """Call a function several times and summarize how long the calls took.
+
+    Args:
+        func (callable): Function that is timed. It is called without arguments.
+        repeat (int): Number of times the function is called.
+        setup (callable, optional): Called before each call of `func` without being timed. Defaults to
+                                    None.
+
+    Returns:
+        dict: Number of calls and their min, median, mean, and max durations in seconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        func()
+        durations.append(perf_counter() - start)
+    return {
+        "calls": repeat,
+        "min": min(durations),
+        "median": median(durations),
+        "mean": mean(durations),
+        "max": max(durations)
+    }
+
+
+def benchmark_parser(description):
+    """Argument parser of a benchmark script, with an --output option for `write_report`.
+
+    Args:
+        description (str): Module docstring of the script, which is shown as its help.
+    """
+    parser = argparse.ArgumentParser(description=description,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="File the JSON results are written to. Defaults to stdout.")
+    return parser
+
+
+def write_report(results, meta, output=None, **sections):
+    """Write the results of a benchmark as JSON, with the time of the run and the Python version.
+
+    Args:
+        results (dict): Maps benchmark names to their results.
+        meta (dict): Settings of the run, added to the report's "meta".
+        output (str, optional): File the report is written to. Defaults to None, meaning stdout.
+        **sections: Other top-level sections of the report.
+    """
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            **meta
+        },
+        "results": results,
+        **sections
+    }
+    text = json.dumps(report, indent=2) + "\n"
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
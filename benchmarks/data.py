@@ -0,0 +1,105 @@
+"""Generate synthetic users, habits, and habit histories for benchmarks.
+
+Habit histories alternate between runs of completed and missed days with random lengths, which are
+written directly as HabitStreak documents, or as the habits' embedded streak intervals when the streak
+storage is "embedded", rather than by toggling one day at a time.
+"""
+import random
+from datetime import date, datetime, timedelta
+from bson import ObjectId
+from habit_tracker import bcrypt
+from habit_tracker.documents import User, Habit, HabitStreak
+
+BENCHMARK_PASSWORD = "benchmark-password"
+
+
+def random_streaks(rng, start_date, end_date, completion_rate, fragmentation):
+    """Generate random streaks of completed days between two dates.
+
+    Args:
+        rng (random.Random): Source of randomness.
+        start_date (datetime.date): Inclusive first date that may be completed.
+        end_date (datetime.date): Inclusive last date that may be completed.
+        completion_rate (float): Expected fraction of days that are completed, between 0 and 1.
+        fragmentation (float): Between 0 and 1. Higher values produce more, shorter streaks. The
+                               mean streak length is 1 / fragmentation days.
+
+    Yields:
+        tuple: Inclusive (start, end) datetime.date of each streak, in order.
+    """
+    if completion_rate <= 0:
+        return
+    if completion_rate >= 1:
+        yield start_date, end_date
+        return
+    mean_complete_days = 1 / fragmentation
+    mean_missed_days = mean_complete_days * (1 - completion_rate) / completion_rate
+    complete = rng.random() < completion_rate
+    curr_date = start_date
+    while curr_date <= end_date:
+        mean_days = mean_complete_days if complete else mean_missed_days
+        num_days = max(1, round(rng.expovariate(1 / mean_days)))
+        run_end = min(curr_date + timedelta(num_days - 1), end_date)
+        if complete:
+            yield curr_date, run_end
+        curr_date = run_end + timedelta(1)
+        complete = not complete
+
+
+def generate_user(email, num_habits=20, history_days=730, completion_rate=0.6, fragmentation=0.3,
+                  seed=0):
+    """Create a user with habits that have random completion histories.
+
+    Habits are created at random times within the history, and about half of them are as old as the
+    history itself.
+
+    Args:
+        email (str): Email of the new user.
+        num_habits (int, optional): Number of habits the user tracks. Defaults to 20.
+        history_days (int, optional): Age of the user's oldest habit in days. Defaults to 730.
+        completion_rate (float, optional): Expected fraction of days that habits are completed.
+                                           Defaults to 0.6.
+        fragmentation (float, optional): Between 0 and 1. Higher values produce more, shorter streaks.
+                                         Defaults to 0.3.
+        seed (int, optional): Seed for the random number generator. Defaults to 0.
+
+    Returns:
+        User: The new user document.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    hashed_pass = bcrypt.generate_password_hash(BENCHMARK_PASSWORD).decode("utf-8")
+    user = User(email=email, password=hashed_pass).save()
+
+    habits = []
+    streaks = []
+    for i in range(num_habits):
+        age = history_days if rng.random() < 0.5 else rng.randint(0, history_days)
+        created = today - timedelta(age)
+        habit = Habit(
+            id=ObjectId(),
+            name=f"Habit {i}",
+            slug=f"habit-{i}-0",
+            user=user.id,
+            date_created=datetime.combine(created, datetime.min.time())
+        )
+        habits.append(habit)
+        for start, end in random_streaks(rng, created, today, completion_rate, fragmentation):
+            if Habit.streak_storage == "embedded":
+                habit.streak_intervals.append([
+                    datetime.combine(start, datetime.min.time()),
+                    datetime.combine(end, datetime.min.time())
+                ])
+                continue
+            streaks.append(HabitStreak(
+                start=datetime.combine(start, datetime.min.time()),
+                end=datetime.combine(end, datetime.min.time()),
+                streak_length=(end - start).days + 1,
+                habit=habit.id,
+                user=user.id
+            ))
+
+    Habit.objects.insert(habits, load_bulk=False)
+    if streaks:
+        HabitStreak.objects.insert(streaks, load_bulk=False)
+    return user
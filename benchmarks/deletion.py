@@ -0,0 +1,109 @@
+"""Benchmark how long deleting an account or a habit takes as its history grows.
+
+For each history length, a synthetic user is generated with `benchmarks.data` before every call and
+then deleted in one of these ways:
+
+- cascade: MongoEngine's cascading delete rules, which were used before the bulk deletes. Habits also
+  have their completions removed from the daily rollups first, as they did then.
+- bulk: `User.delete` / `Habit.delete`, which clear each collection with a single `delete_many`
+- deferred: the part of the bulk delete that a request waits for when ASYNC_DELETION is set
+
+Results are printed as JSON.
+
+Usage:
+    python -m benchmarks.deletion [--habits 20] [--days 90 365 730 1825] [--repeat 3]
+                                  [--output results.json]
+"""
+import itertools
+from datetime import timedelta
+from benchmarks.common import benchmark_parser, create_benchmark_app, time_calls, write_report
+
+DELETE_METHODS = ["cascade", "bulk", "deferred"]
+
+
+def time_deletions(num_habits, history_days, repeat):
+    """Time each way of deleting a user and one of their habits.
+
+    Args:
+        num_habits (int): Number of habits of each generated user.
+        history_days (int): Days of history of each generated user.
+        repeat (int): Number of users deleted with each method.
+
+    Returns:
+        dict: Maps "<account|habit>[<method>]" names to timing summaries, and "streaks" to the number
+              of streaks of each generated user.
+    """
+    from mongoengine import Document
+    from benchmarks.data import generate_user
+    from habit_tracker.documents import DailyRollup, Habit
+
+    emails = (f"delete-{history_days}-{n}@example.com" for n in itertools.count())
+    generated = {}
+    deferred = []
+
+    def cascade_habit():
+        habit = generated["habit"]
+        DailyRollup.increment(habit.user_id, {
+            start + timedelta(n): -1
+            for start, end in habit.get_completion_bitmap().streaks()
+            for n in range((end - start).days + 1)
+        })
+        Document.delete(habit)
+
+    def setup():
+        # Finish deferred deletions and remove the previous user untimed, so the database doesn't grow
+        # between calls
+        while deferred:
+            deferred.pop()()
+        if "user" in generated:
+            generated["user"].delete()
+        user = generate_user(email=next(emails), num_habits=num_habits, history_days=history_days)
+        DailyRollup.rebuild(user.id, repair=True)
+        generated["user"] = user
+        generated["habit"] = Habit.objects(user=user.id).order_by("date_created").first()
+
+    deletes = {
+        "account": {
+            "cascade": lambda: Document.delete(generated["user"]),
+            "bulk": lambda: generated["user"].delete(),
+            "deferred": lambda: generated["user"].delete(defer=deferred.append),
+        },
+        "habit": {
+            "cascade": cascade_habit,
+            "bulk": lambda: generated["habit"].delete(),
+            "deferred": lambda: generated["habit"].delete(defer=deferred.append),
+        }
+    }
+
+    setup()
+    habit_ids = Habit.objects(user=generated["user"].id).scalar("id")
+    results = {"streaks": sum(len(streaks) for streaks in Habit.get_streaks(habit_ids).values())}
+    for target, methods in deletes.items():
+        for method in DELETE_METHODS:
+            results[f"{target}[{method}]"] = time_calls(methods[method], repeat, setup=setup)
+    return results
+
+
+def main():
+    parser = benchmark_parser(__doc__)
+    parser.add_argument("--habits", type=int, default=20,
+                        help="Number of habits of each generated user.")
+    parser.add_argument("--days", type=int, nargs="+", default=[90, 365, 730, 1825],
+                        help="Days of history of the generated users.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of deletions timed for each method.")
+    args = parser.parse_args()
+
+    app = create_benchmark_app()
+    with app.app_context():
+        results = {str(days): time_deletions(args.habits, days, args.repeat) for days in args.days}
+
+    write_report(results, {
+        "habits": args.habits,
+        "repeat": args.repeat,
+        "streak_storage": app.config["STREAK_STORAGE"]
+    }, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Benchmark password checks under concurrent logins to size PASSWORD_HASH_THREADS.
+
+For each pool size, a burst of concurrent password checks is run through the app's PasswordHasher,
+as a spike of logins would. The throughput and the latency of each check, including the time spent
+waiting for a thread, are compared against the CPUs available. Results are printed as JSON.
+
+Usage:
+    python -m benchmarks.passwords [--threads 1 2 4] [--logins 32] [--rounds 12] [--output results.json]
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from time import perf_counter
+from benchmarks.common import benchmark_parser, create_benchmark_app, write_report
+
+
+def time_logins(app, num_threads, num_logins):
+    """Check a password from `num_logins` threads at once with a pool of `num_threads` hashing threads.
+
+    Returns:
+        dict: Throughput of the checks and the median and max latency of each check in seconds.
+    """
+    from habit_tracker import bcrypt
+    from habit_tracker.concurrency import PasswordHasher
+
+    app.config["PASSWORD_HASH_THREADS"] = num_threads
+    app.config["PASSWORD_HASH_MAX_QUEUED"] = num_logins
+    hasher = PasswordHasher(bcrypt)
+    hasher.init_app(app)
+    pw_hash = hasher.generate_password_hash("benchmark-password")
+
+    def check():
+        start = perf_counter()
+        assert hasher.check_password_hash(pw_hash, "benchmark-password")
+        return perf_counter() - start
+
+    start = perf_counter()
+    # Each client thread is a request waiting for its password to be checked
+    with ThreadPoolExecutor(max_workers=num_logins) as clients:
+        latencies = list(clients.map(lambda _: check(), range(num_logins)))
+    seconds = perf_counter() - start
+    if hasher.executor is not None:
+        hasher.executor.shutdown()
+
+    stats = hasher.stats()["operations"]["check"]
+    return {
+        "logins_per_second": num_logins / seconds,
+        "median_latency": median(latencies),
+        "max_latency": max(latencies),
+        "mean_hash_seconds": stats["mean_seconds"],
+        "mean_wait_seconds": stats["mean_wait_seconds"]
+    }
+
+
+def main():
+    parser = benchmark_parser(__doc__)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4],
+                        help="Values of PASSWORD_HASH_THREADS that are compared.")
+    parser.add_argument("--logins", type=int, default=32, help="Number of concurrent logins.")
+    parser.add_argument("--rounds", type=int, default=12, help="BCRYPT_LOG_ROUNDS of the hashes.")
+    args = parser.parse_args()
+
+    app = create_benchmark_app()
+    app.config["BCRYPT_LOG_ROUNDS"] = args.rounds
+    with app.app_context():
+        results = {
+            str(num_threads): time_logins(app, num_threads, args.logins) for num_threads in args.threads
+        }
+
+    write_report(results, {
+        "cpus": os.cpu_count(),
+        "logins": args.logins,
+        "rounds": args.rounds
+    }, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Benchmark the habit tracker's main data paths and pages against an in-memory mongomock database.
+
+A synthetic user is generated with `benchmarks.data`, then each benchmark is timed both with an empty
+completion cache (cold) and after it has been filled (warm). Results are written as JSON so that runs
+can be compared. With `--storage both`, the benchmarks are run once for each streak storage and their
+names are prefixed with the storage. The number of streaks of the user is reported for each storage.
+
+Usage:
+    python -m benchmarks.run [--habits 20] [--days 730] [--fragmentation 0.3] [--repeat 5]
+                             [--storage collection|embedded|both] [--output results.json]
+"""
+import random
+from datetime import date, timedelta
+from benchmarks.common import benchmark_parser, create_benchmark_app, time_calls, write_report
+
+
+def run_benchmarks(app, user, repeat):
+    """Time each benchmark for a generated user.
+
+    Args:
+        app (Flask): App created with the benchmark config.
+        user (User): User generated by `benchmarks.data.generate_user`.
+        repeat (int): Number of times each benchmark is called.
+
+    Returns:
+        dict: Maps benchmark names to timing summaries.
+    """
+    from habit_tracker import fragment_cache
+    from habit_tracker.cache import chart_cache, completion_cache
+    from habit_tracker.documents import Habit
+    from habit_tracker.habits.routes import HISTORY_GRID_BREAKS
+    from habit_tracker.habits.utils import (create_habit_checklist, create_habit_history_grid,
+                                            habit_strength, habit_strengths)
+    from benchmarks.data import BENCHMARK_PASSWORD
+
+    def clear_caches():
+        completion_cache.clear()
+        chart_cache.clear()
+        # Only the cached fragments are cleared, so hits and misses are counted over the whole run
+        fragment_cache.backend.clear()
+
+    habits = Habit.objects(user=user.id, active=True).order_by("date_created")
+    list(habits)  # Fetch the habits up front so that only the benchmarked work is timed
+    habit = habits[0]
+    rng = random.Random(0)
+
+    def toggle_twice():
+        # Toggling the same date twice leaves the history unchanged for the next call
+        habit_age = (date.today() - habit.date_created.date()).days
+        my_date = date.today() - timedelta(rng.randint(0, habit_age))
+        habit.toggle_complete(my_date)
+        habit.toggle_complete(my_date)
+
+    benchmarks = {
+        "create_habit_checklist": lambda: create_habit_checklist(
+            habits=habits, num_days=7, end_date=date.today()),
+        "create_habit_history_grid": lambda: create_habit_history_grid(
+            habits=habits, break_points=HISTORY_GRID_BREAKS, end_date=date.today()),
+        "habit_strength": lambda: habit_strength(habit, 100, 30),
+        "habit_strengths_all_habits": lambda: habit_strengths(habits, 100, [7, 30, 90]),
+        "toggle_complete_twice": toggle_twice,
+    }
+
+    results = {}
+    with app.test_request_context():
+        for name, func in benchmarks.items():
+            results[f"{name}[cold]"] = time_calls(func, repeat, setup=clear_caches)
+            func()
+            results[f"{name}[warm]"] = time_calls(func, repeat)
+
+    client = app.test_client()
+    client.post("/login", data={"email": user.email, "password": BENCHMARK_PASSWORD})
+    pages = {
+        "GET /my_habits/": "/my_habits/",
+        "GET /habit/<slug>": f"/habit/{habit.slug}",
+        "GET /habit/<slug>/strength": f"/habit/{habit.slug}/strength",
+    }
+    for name, url in pages.items():
+        def get_page():
+            response = client.get(url)
+            assert response.status_code == 200, f"{url} returned {response.status_code}"
+        results[f"{name}[cold]"] = time_calls(get_page, repeat, setup=clear_caches)
+        get_page()
+        results[f"{name}[warm]"] = time_calls(get_page, repeat)
+    return results
+
+
+def main():
+    parser = benchmark_parser(__doc__)
+    parser.add_argument("--habits", type=int, default=20,
+                        help="Number of habits of the generated user.")
+    parser.add_argument("--days", type=int, default=730, help="Days of history of the generated user.")
+    parser.add_argument("--completion-rate", type=float, default=0.6,
+                        help="Fraction of days completed.")
+    parser.add_argument("--fragmentation", type=float, default=0.3,
+                        help="Between 0 and 1. Higher values produce more, shorter streaks.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated data.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of times each benchmark is called.")
+    parser.add_argument("--storage", choices=["collection", "embedded", "both"],
+                        help="Streak storage that is benchmarked. Defaults to the STREAK_STORAGE "
+                             "config value.")
+    args = parser.parse_args()
+
+    app = create_benchmark_app()
+    storages = {
+        None: [app.config["STREAK_STORAGE"]],
+        "both": ["collection", "embedded"]
+    }.get(args.storage, [args.storage])
+    results = {}
+    num_streaks = {}
+    with app.app_context():
+        from benchmarks.data import generate_user
+        from habit_tracker.documents import Habit
+        for storage in storages:
+            Habit.streak_storage = storage
+            user = generate_user(
+                email=f"benchmark-{storage}@example.com",
+                num_habits=args.habits,
+                history_days=args.days,
+                completion_rate=args.completion_rate,
+                fragmentation=args.fragmentation,
+                seed=args.seed
+            )
+            habit_ids = Habit.objects(user=user.id).scalar("id")
+            streaks = Habit.get_streaks(habit_ids)
+            num_streaks[storage] = sum(len(habit_streaks) for habit_streaks in streaks.values())
+            storage_results = run_benchmarks(app, user, args.repeat)
+            prefix = f"{storage}:" if len(storages) > 1 else ""
+            results.update({f"{prefix}{name}": result for name, result in storage_results.items()})
+
+    from habit_tracker import fragment_cache
+
+    # The fragment cache's hits and misses are counted over all of the benchmarks
+    write_report(results, {
+        "habits": args.habits,
+        "days": args.days,
+        "completion_rate": args.completion_rate,
+        "fragmentation": args.fragmentation,
+        "seed": args.seed,
+        # Number of streaks of the generated user in each storage
+        "streaks": num_streaks,
+        "streak_storage": args.storage or storages[0],
+        "repeat": args.repeat
+    }, output=args.output, fragment_cache=fragment_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
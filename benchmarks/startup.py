@@ -0,0 +1,81 @@
+"""Benchmark how long it takes to import Habit Tracker and create the Flask app, and the memory it uses.
+
+Each run happens in a fresh interpreter so that nothing is already imported. Results are printed as
+JSON. Pass --max-seconds and/or --max-rss-mb to exit with an error when startup regresses past them.
+
+Usage:
+    python -m benchmarks.startup [--config dev] [--runs 5] [--max-seconds 1.5] [--max-rss-mb 120]
+                                 [--output results.json]
+"""
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+from benchmarks.common import benchmark_parser, set_placeholder_env, write_report
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries that should only be imported when they are first needed
+HEAVY_MODULES = ["pandas", "matplotlib"]
+
+# Code run in the child interpreter
+CHILD_CODE = """
+import json, resource, sys, time
+start = time.perf_counter()
+from habit_tracker import create_app
+app = create_app(sys.argv[1])
+seconds = time.perf_counter() - start
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+max_rss_mb = max_rss / 1024 ** 2 if sys.platform == "darwin" else max_rss / 1024
+print(json.dumps({
+    "seconds": seconds,
+    "max_rss_mb": max_rss_mb,
+    "heavy_modules_loaded": [name for name in sys.argv[2:] if name in sys.modules]
+}))
+"""
+
+
+def measure_startup(config):
+    """Import the app and create it in a fresh interpreter, returning the measurements as a dict"""
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_CODE, config] + HEAVY_MODULES,
+        cwd=REPO_ROOT,
+        env=set_placeholder_env(dict(os.environ)),
+        stdout=subprocess.PIPE,
+        check=True
+    )
+    return json.loads(result.stdout.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = benchmark_parser(__doc__)
+    parser.add_argument("--config", default="dev", help="Config passed to create_app. Defaults to dev.")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters to measure.")
+    parser.add_argument("--max-seconds", type=float, help="Fail if the median startup time is higher.")
+    parser.add_argument("--max-rss-mb", type=float, help="Fail if the median peak memory is higher.")
+    args = parser.parse_args()
+
+    runs = [measure_startup(args.config) for _ in range(args.runs)]
+    results = {
+        "median_seconds": median(run["seconds"] for run in runs),
+        "median_max_rss_mb": median(run["max_rss_mb"] for run in runs),
+        "heavy_modules_loaded": runs[-1]["heavy_modules_loaded"]
+    }
+    write_report(results, {
+        "config": args.config,
+        "runs": args.runs
+    }, output=args.output)
+
+    failures = []
+    if args.max_seconds is not None and results["median_seconds"] > args.max_seconds:
+        failures.append(f"startup took {results['median_seconds']:.3f}s (max {args.max_seconds}s)")
+    if args.max_rss_mb is not None and results["median_max_rss_mb"] > args.max_rss_mb:
+        failures.append(f"startup used {results['median_max_rss_mb']:.1f}MB (max {args.max_rss_mb}MB)")
+    if failures:
+        sys.exit("Startup regression: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,19 @@ from flask import Flask
 from flask_mongoengine import MongoEngine
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+from habit_tracker.cache import FragmentCache
+from habit_tracker.concurrency import PasswordHasher, ViewFetcher
+from habit_tracker.instrumentation import DatabaseInstrumentation
 
 
 # Initialize flask extensions
 db = MongoEngine()
 bcrypt = Bcrypt()
+password_hasher = PasswordHasher(bcrypt)
 login_manager = LoginManager()
+db_instrumentation = DatabaseInstrumentation()
+fragment_cache = FragmentCache()
+view_fetcher = ViewFetcher()
 
 # Route that user will be redirected to if they access a page that requires login
 login_manager.login_view = "users.login"
@@ -28,7 +35,9 @@ def create_app(config="dev"):
 
     cfg_dict = {
         "dev": "habit_tracker.config.DevConfig",
-        "prod": "habit_tracker.config.ProdConfig"
+        "prod": "habit_tracker.config.ProdConfig",
+        "benchmark": "habit_tracker.config.BenchmarkConfig",
+        "test": "habit_tracker.config.TestConfig"
     }
     config_class = cfg_dict.get(config)
     if config_class is None:
@@ -37,9 +46,30 @@ def create_app(config="dev"):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # Database commands are only reported if instrumentation is set up before connecting
+    if app.config["DB_INSTRUMENTATION"]:
+        db_instrumentation.init_app(app)
     db.init_app(app)
     bcrypt.init_app(app)
+    password_hasher.init_app(app)
     login_manager.init_app(app)
+    fragment_cache.init_app(app)
+    view_fetcher.init_app(app)
+
+    from habit_tracker.cache import completion_cache, chart_cache, user_cache  # noqa 402
+    completion_cache.resize(app.config["COMPLETION_CACHE_MAX_BYTES"])
+    chart_cache.resize(app.config["CHART_CACHE_MAX_BYTES"])
+    user_cache.ttl = app.config["USER_CACHE_TTL"]
+    user_cache.resize(app.config["USER_CACHE_MAX_USERS"])
+
+    from habit_tracker.documents import Habit  # noqa 402
+    Habit.streak_storage = app.config["STREAK_STORAGE"]
+
+    if app.config["PRELOAD_LIBRARIES"]:
+        # Otherwise imported lazily by the first request that needs them
+        import pandas  # noqa 401
+        import matplotlib.figure  # noqa 401
+        import matplotlib.backends.backend_svg  # noqa 401
 
     # Import blueprint objects after db setup
     from habit_tracker.main.routes import main  # noqa 402
@@ -51,4 +81,7 @@ def create_app(config="dev"):
     app.register_blueprint(habits)
     app.register_blueprint(errors)
 
+    from habit_tracker.habits.commands import habits_cli  # noqa 402
+    app.cli.add_command(habits_cli)
+
     return app
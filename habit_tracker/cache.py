@@ -0,0 +1,450 @@
+import hashlib
+import os
+import sys
+import tempfile
+from collections import Counter, OrderedDict
+from datetime import date, datetime, timedelta
+from threading import Lock
+from time import monotonic
+from markupsafe import Markup
+import numpy as np
+
+# Number of values a FileCache writes between checks of the total size of its directory
+FILE_CACHE_PRUNE_INTERVAL = 100
+
+
+class LRUCache:
+    """Thread-safe in-process cache that evicts the least recently used values.
+
+    The cache is bounded by the total size of its values rather than by the number of keys. By
+    default every value has a size of 1, which bounds the number of keys instead.
+
+    Args:
+        max_size (int): Maximum total size of the cached values. A size of 0 disables the cache.
+        sizeof (callable, optional): Function returning the size of a value. Defaults to None.
+        ttl (float, optional): Seconds after which cached values expire. Defaults to None, meaning
+                               values are only removed when they're evicted.
+    """
+
+    def __init__(self, max_size, sizeof=None, ttl=None):
+        self.max_size = max_size
+        self.sizeof = sizeof if sizeof is not None else (lambda value: 1)
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """Return the value cached for a key, or `default` if the key isn't cached"""
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+            value, _, expiry = self._items[key]
+            if expiry is not None and monotonic() >= expiry:
+                self._remove(key)
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Cache a value, evicting the least recently used values until the cache fits its max size"""
+        size = self.sizeof(value)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_size:
+                return
+            expiry = monotonic() + self.ttl if self.ttl is not None else None
+            self._items[key] = (value, size, expiry)
+            self.size += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        """Remove a key from the cache and return its value, or `default` if the key isn't cached"""
+        with self._lock:
+            return self._remove(key, default)
+
+    def resize(self, max_size):
+        """Change the max size of the cache, evicting values if it shrinks"""
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def clear(self):
+        """Remove all values from the cache and reset its statistics"""
+        with self._lock:
+            self._items.clear()
+            self.size = self.hits = self.misses = 0
+
+    def _remove(self, key, default=None):
+        # Caller must hold the lock
+        if key not in self._items:
+            return default
+        value, size, _ = self._items.pop(key)
+        self.size -= size
+        return value
+
+    def _evict(self):
+        # Caller must hold the lock
+        while self.size > self.max_size:
+            _, (_, size, _) = self._items.popitem(last=False)
+            self.size -= size
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FileCache:
+    """Cache that stores string values as files in a directory, so several processes can share it.
+
+    Has the same interface as LRUCache. The total size of the files is checked periodically, and the
+    least recently used files are removed once it exceeds the max size.
+
+    Args:
+        directory (str): Directory the values are stored in. It is created if it doesn't exist.
+        max_size (int): Maximum total size (bytes) of the cached values. A size of 0 disables the cache.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._num_sets = 0
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def get(self, key, default=None):
+        """Return the value cached for a key, or `default` if the key isn't cached"""
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as file:
+                value = file.read()
+            # Modification times record when files were last used, for evicting the least recently used
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return default
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Cache a value, replacing the key's file atomically so readers never see a partial value"""
+        if len(value) > self.max_size:
+            return
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.directory, delete=False,
+                                         prefix=".tmp") as file:
+            file.write(value)
+        os.replace(file.name, self._path(key))
+        with self._lock:
+            self._num_sets += 1
+            prune = self._num_sets % FILE_CACHE_PRUNE_INTERVAL == 0
+        if prune:
+            self._evict()
+
+    def pop(self, key, default=None):
+        """Remove a key from the cache and return its value, or `default` if the key isn't cached"""
+        value = self.get(key, default)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        return value
+
+    def resize(self, max_size):
+        """Change the max size of the cache, evicting values if it shrinks"""
+        self.max_size = max_size
+        self._evict()
+
+    def clear(self):
+        """Remove all values from the cache and reset its statistics"""
+        for entry in self._entries():
+            self._remove_file(entry.path)
+        with self._lock:
+            self.hits = self.misses = 0
+
+    @property
+    def size(self):
+        """Total size (bytes) of the cached values"""
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        return [
+            entry for entry in os.scandir(self.directory)
+            if entry.is_file() and not entry.name.startswith(".")
+        ]
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Removed by another process
+            pass
+
+    def _evict(self):
+        files = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_size:
+                break
+            self._remove_file(path)
+            total -= size
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def __len__(self):
+        return len(self._entries())
+
+
+class FragmentCache:
+    """Flask extension that caches rendered fragments of pages, such as the checklist and history grid.
+
+    Fragments are keyed by a version of the data they show and the current date, so they never need
+    to be invalidated: when the data changes, the old fragments are no longer used and are evicted.
+    The backend is chosen with FRAGMENT_CACHE_BACKEND: "memory" caches fragments in each process,
+    "file" caches them in FRAGMENT_CACHE_DIR where every process on the server can use them, and
+    "none" disables the cache.
+    """
+
+    def __init__(self):
+        self.backend = LRUCache(max_size=0, sizeof=len)
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def init_app(self, app):
+        backend = app.config["FRAGMENT_CACHE_BACKEND"]
+        max_size = app.config["FRAGMENT_CACHE_MAX_BYTES"]
+        if backend == "memory":
+            self.backend = LRUCache(max_size=max_size, sizeof=len)
+        elif backend == "file":
+            self.backend = FileCache(app.config["FRAGMENT_CACHE_DIR"], max_size=max_size)
+        elif backend == "none":
+            self.backend = LRUCache(max_size=0)
+        else:
+            raise ValueError(
+                f"FRAGMENT_CACHE_BACKEND must be 'memory', 'file', or 'none', not '{backend}'."
+            )
+
+    def get_or_render(self, name, owner_id, version, render, daily=True):
+        """Return a cached fragment, or render and cache it if there isn't one for the current data.
+
+        Args:
+            name (str): Name of the fragment, e.g. "checklist".
+            owner_id (ObjectId): Id of the document whose data the fragment shows, e.g. the user.
+            version (int or str): Version of the data, which changes whenever the fragment would change.
+            render (callable): Function without arguments that renders the fragment.
+            daily (bool, optional): Whether the fragment depends on the current date, so it's rendered
+                                    again each day. Defaults to True.
+
+        Returns:
+            markupsafe.Markup: The rendered fragment, which can be inserted into templates as is.
+        """
+        key = (name, str(owner_id), version, date.today().isoformat() if daily else None)
+        fragment = self.backend.get(key)
+        if fragment is None:
+            self.misses[name] += 1
+            fragment = str(render())
+            self.backend.set(key, fragment)
+        else:
+            self.hits[name] += 1
+        return Markup(fragment)
+
+    def stats(self):
+        """Hits and misses of each fragment since the cache was cleared, and the size of the cache"""
+        return {
+            "backend": type(self.backend).__name__,
+            "size": self.backend.size,
+            "hits": dict(self.hits),
+            "misses": dict(self.misses)
+        }
+
+    def clear(self):
+        """Remove all fragments from the cache and reset its statistics"""
+        self.backend.clear()
+        self.hits.clear()
+        self.misses.clear()
+
+
+class CompletionBitmap:
+    """Compact record of the days on which a habit was completed.
+
+    Stores one bit per day, indexed by the number of days since the habit was created, so a year
+    of history takes up 46 bytes. The `version` is the Habit version the bitmap was built from,
+    which is used to detect bitmaps that are out of date with the database.
+
+    Args:
+        first_day (datetime.date): Date represented by the first bit, i.e. the habit's creation date.
+        version (int): Version of the habit that the bitmap represents.
+        streaks (iterable, optional): (start, end) tuples of datetime.date objects of completed days.
+    """
+
+    __slots__ = ("first_day", "version", "bits")
+
+    def __init__(self, first_day, version, streaks=()):
+        self.first_day = first_day
+        self.version = version
+        self.bits = bytearray()
+        for start, end in streaks:
+            self.set_range(start, end, True)
+
+    def __getitem__(self, my_date):
+        """Return whether the habit was completed on a given date"""
+        day = (my_date - self.first_day).days
+        if day < 0 or day >= len(self.bits) * 8:
+            return False
+        return bool(self.bits[day // 8] & (1 << day % 8))
+
+    def __setitem__(self, my_date, complete):
+        """Set whether the habit was completed on a given date"""
+        self.set_range(my_date, my_date, complete)
+
+    def set_range(self, start_date, end_date, complete):
+        """Set whether the habit was completed on each date between inclusive start and end dates"""
+        first = max(0, (start_date - self.first_day).days)
+        last = (end_date - self.first_day).days
+        if last < first:
+            return
+        if last >= len(self.bits) * 8:
+            if not complete:
+                last = len(self.bits) * 8 - 1
+            else:
+                self.bits.extend(bytes(last // 8 + 1 - len(self.bits)))
+        for day in range(first, last + 1):
+            if complete:
+                self.bits[day // 8] |= 1 << day % 8
+            else:
+                self.bits[day // 8] &= ~(1 << day % 8) & 0xFF
+
+    def range(self, start_date, end_date):
+        """Get whether the habit was completed on each date between inclusive start and end dates.
+
+        Args:
+            start_date (datetime.date): Inclusive start date of range.
+            end_date (datetime.date): Inclusive end date of range.
+
+        Returns:
+            numpy.ndarray: Boolean array with one value per date in the range.
+        """
+        num_days = (end_date - start_date).days + 1
+        completion = np.zeros(max(num_days, 0), dtype=bool)
+        offset = (start_date - self.first_day).days
+        first = max(0, offset)
+        last = min(offset + num_days, len(self.bits) * 8)
+        if first < last:
+            # Only unpack the bytes that overlap the range
+            bits = np.unpackbits(
+                np.frombuffer(bytes(self.bits[first // 8:(last + 7) // 8]), dtype=np.uint8),
+                bitorder="little"
+            )
+            completion[first - offset:last - offset] = bits[first % 8:first % 8 + last - first]
+        return completion
+
+    @classmethod
+    def from_array(cls, first_day, version, completion):
+        """Create a bitmap from a boolean array of whether the habit was completed on each day from
+        `first_day`"""
+        bitmap = cls(first_day, version)
+        packed = np.packbits(np.asarray(completion, dtype=bool), bitorder="little")
+        bitmap.bits = bytearray(packed.tobytes())
+        return bitmap
+
+    def streaks(self):
+        """Yield the inclusive (start, end) datetime.date of each run of consecutive completed days,
+        in order"""
+        bits = self._unpacked()
+        # +1 where a run starts and -1 on the day after it ends
+        edges = np.diff(np.concatenate(([0], bits, [0])).astype(np.int8))
+        for start, end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1):
+            yield self.first_day + timedelta(int(start)), self.first_day + timedelta(int(end))
+
+    def streak(self, my_date):
+        """Inclusive (start, end) datetime.date of the streak that contains a date, or None"""
+        if not self[my_date]:
+            return None
+        bits = self._unpacked()
+        day = (my_date - self.first_day).days
+        before = np.flatnonzero(bits[:day] == 0)
+        after = np.flatnonzero(bits[day:] == 0)
+        start = int(before[-1]) + 1 if len(before) else 0
+        end = day + int(after[0]) - 1 if len(after) else len(bits) - 1
+        return self.first_day + timedelta(start), self.first_day + timedelta(end)
+
+    def neighbours(self, my_date):
+        """Find the streak containing a date, or else the streaks next to it on either side.
+
+        Args:
+            my_date (datetime.date): Date that is looked up.
+
+        Returns:
+            tuple: (streak, left_streak, right_streak) dicts with the "start" and "end" datetimes of
+                   each streak, as HabitStreaks are stored, or None where there isn't one. The streak
+                   is None if the others aren't.
+        """
+        streak = self.streak(my_date)
+        if streak is not None:
+            return _raw_streak(streak), None, None
+        # Since the date wasn't completed, any streak containing the day before it ends on that day
+        left_streak = self.streak(my_date - timedelta(1))
+        right_streak = self.streak(my_date + timedelta(1))
+        return None, _raw_streak(left_streak), _raw_streak(right_streak)
+
+    def longest(self):
+        """Length in days of the longest streak, or 0 if there are none"""
+        return max(((end - start).days + 1 for start, end in self.streaks()), default=0)
+
+    def latest(self):
+        """Raw HabitStreak fields of the streak with the latest start date, or None if there are none"""
+        return _raw_streak(max(self.streaks(), default=None))
+
+    def _unpacked(self):
+        """Array with one 0 or 1 per day from `first_day`"""
+        return np.unpackbits(np.frombuffer(bytes(self.bits), dtype=np.uint8), bitorder="little")
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by the bitmap"""
+        return sys.getsizeof(self) + sys.getsizeof(self.bits)
+
+
+def _raw_streak(streak):
+    """Raw HabitStreak "start" and "end" datetimes of a (start, end) tuple of dates, or None"""
+    if streak is None:
+        return None
+    start, end = streak
+    return {
+        "start": datetime.combine(start, datetime.min.time()),
+        "end": datetime.combine(end, datetime.min.time())
+    }
+
+
+# Caches shared by the requests handled in each process. They are resized from the app config.
+
+# Completion bitmaps of recently used habits, keyed by habit id
+completion_cache = LRUCache(max_size=0, sizeof=lambda bitmap: bitmap.nbytes)
+
+# Rendered habit strength charts, keyed by (habit id, habit version, date)
+chart_cache = LRUCache(max_size=0, sizeof=len)
+
+# Raw User documents of recently active users, keyed by the user id stored in their session. Other
+# processes can't invalidate them, so they expire after a short time instead.
+user_cache = LRUCache(max_size=0)
@@ -0,0 +1,222 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+from flask import after_this_request, copy_current_request_context, current_app, g, has_request_context
+from werkzeug.exceptions import ServiceUnavailable
+from habit_tracker.instrumentation import DatabaseInstrumentation
+
+
+def _thread_pool(executor, num_threads, thread_name_prefix):
+    """Thread pool of an extension that is set up from the app config.
+
+    Args:
+        executor (ThreadPoolExecutor): The extension's current pool, or None. It's kept if there is one,
+                                       since the extension is shared by every app in the process.
+        num_threads (int): Number of threads in the pool, or 0 to run tasks in the request's thread, in
+                           which case the current pool is shut down once its running tasks finish.
+        thread_name_prefix (str): Prefix of the names of the pool's threads.
+
+    Returns:
+        ThreadPoolExecutor: The pool, or None with 0 threads.
+    """
+    if num_threads == 0:
+        if executor is not None:
+            executor.shutdown(wait=False)
+        return None
+    if executor is not None:
+        return executor
+    return ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix=thread_name_prefix)
+
+
+class ViewFetcher:
+    """Flask extension that runs independent parts of a view, such as database queries, in parallel.
+
+    Tasks run on a thread pool shared by every request in the process, with VIEW_FETCH_THREADS
+    threads. They share mongoengine's connection, so each task's queries use pymongo's connection
+    pool. With 0 threads the tasks run one after another in the request's thread. The time taken by
+    each task is added to the response's Server-Timing header.
+
+    Tasks run in a copy of the request context, so they can render templates and build URLs, but they
+    must not read the request or `current_user`. Read those in the view and pass the values in instead.
+    """
+
+    def __init__(self):
+        self.executor = None
+
+    def init_app(self, app):
+        self.executor = _thread_pool(self.executor, app.config["VIEW_FETCH_THREADS"], "view-fetch")
+
+        @app.after_request
+        def report_stage_timings(response):
+            timings = g.pop("stage_timings", None)
+            if timings:
+                response.headers.add(
+                    "Server-Timing",
+                    ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration in timings.items())
+                )
+            return response
+
+    def run(self, **tasks):
+        """Run functions at the same time and wait for all of them to finish.
+
+        Args:
+            **tasks (callable): Functions without arguments, keyed by the name of the stage they run.
+
+        Returns:
+            dict: Maps the name of each task to the value it returned.
+        """
+        # Queries made by the tasks are included in the request's database instrumentation, if enabled
+        db_stats = g.get("db_stats")
+
+        def timed(func, count_queries=False):
+            def run_task():
+                task_stats = None
+                if count_queries and db_stats is not None:
+                    # Tasks on the pool count their own queries, which are merged once they finish
+                    task_stats = g.db_stats = DatabaseInstrumentation.new_stats()
+                start = perf_counter()
+                result = func()
+                return result, perf_counter() - start, task_stats
+            return run_task
+
+        if self.executor is None:
+            outcomes = {name: timed(func)() for name, func in tasks.items()}
+        else:
+            futures = {
+                name: self.executor.submit(
+                    copy_current_request_context(timed(func, count_queries=True))
+                )
+                for name, func in tasks.items()
+            }
+            outcomes = {name: future.result() for name, future in futures.items()}
+
+        timings = g.setdefault("stage_timings", {})
+        results = {}
+        for name, (result, duration, task_stats) in outcomes.items():
+            results[name] = result
+            timings[name] = duration
+            if task_stats is not None:
+                DatabaseInstrumentation.merge_stats(db_stats, task_stats)
+        return results
+
+
+def call_after_response(func):
+    """Call a function without arguments once the current response has been sent.
+
+    The function runs in the request's worker when the response is closed, so the client doesn't wait
+    for it. It runs outside of the request context, and errors are logged since the response has
+    already been sent.
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        try:
+            func()
+        except Exception:
+            app.logger.exception("Function called after the response failed.")
+
+    @after_this_request
+    def add_callback(response):
+        response.call_on_close(run)
+        return response
+
+
+class PasswordHasher:
+    """Flask extension that hashes and checks passwords with bcrypt on a bounded thread pool.
+
+    bcrypt releases the GIL while hashing, so with PASSWORD_HASH_THREADS threads at most that many
+    hashes use the CPU at once, however many logins arrive. The request's thread blocks until its hash
+    is done, so other requests are only served meanwhile by the other request threads of the worker,
+    which is why the Procfile runs gthread workers with WEB_THREADS threads. Up to
+    PASSWORD_HASH_MAX_QUEUED more wait for a thread. Beyond that, requests wait up to
+    PASSWORD_HASH_TIMEOUT seconds for a place in the queue before failing with a 503. With 0 threads
+    passwords are hashed in the request's thread.
+
+    The cost factor is Flask-Bcrypt's BCRYPT_LOG_ROUNDS. Time spent waiting for and running hashes is
+    added to the response's Server-Timing header and totalled in `stats`.
+
+    Args:
+        bcrypt (flask_bcrypt.Bcrypt): Extension that does the hashing.
+    """
+
+    def __init__(self, bcrypt):
+        self.bcrypt = bcrypt
+        self.executor = None
+        self.log_rounds = None
+        self.timeout = None
+        self._slots = None
+        self._stats_lock = Lock()
+        self.calls = Counter()
+        self.seconds = Counter()
+        self.wait_seconds = Counter()
+        self.rejected = 0
+
+    def init_app(self, app):
+        num_threads = app.config["PASSWORD_HASH_THREADS"]
+        self.executor = _thread_pool(self.executor, num_threads, "password-hash")
+        self._slots = BoundedSemaphore(max(num_threads, 1) + app.config["PASSWORD_HASH_MAX_QUEUED"])
+        self.timeout = app.config["PASSWORD_HASH_TIMEOUT"]
+        self.log_rounds = app.config["BCRYPT_LOG_ROUNDS"]
+
+    def generate_password_hash(self, password):
+        """Hash a password with the configured cost factor, returning the hash as a string"""
+        pw_hash = self._run("hash", self.bcrypt.generate_password_hash, password, self.log_rounds)
+        return pw_hash.decode("utf-8")
+
+    def check_password_hash(self, pw_hash, password):
+        """Check whether a password matches a hash"""
+        return self._run("check", self.bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Check whether a hash was made with a different cost factor than the configured one"""
+        # bcrypt hashes look like $2b$<cost>$<salt and hash>
+        parts = pw_hash.split("$")
+        return len(parts) < 4 or not parts[2].isdigit() or int(parts[2]) != self.log_rounds
+
+    def _run(self, name, func, *args):
+        """Call a hashing function on the thread pool once there's room, recording the time taken"""
+        queued = perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._stats_lock:
+                self.rejected += 1
+            raise ServiceUnavailable("Too many passwords are being checked. Please try again shortly.")
+        try:
+            def timed():
+                start = perf_counter()
+                return func(*args), start, perf_counter()
+
+            if self.executor is None:
+                result, start, end = timed()
+            else:
+                result, start, end = self.executor.submit(timed).result()
+        finally:
+            self._slots.release()
+
+        with self._stats_lock:
+            self.calls[name] += 1
+            self.seconds[name] += end - start
+            self.wait_seconds[name] += start - queued
+        if has_request_context():
+            timings = g.setdefault("stage_timings", {})
+            timings[f"password_{name}"] = timings.get(f"password_{name}", 0) + end - start
+            timings[f"password_{name}_wait"] = timings.get(f"password_{name}_wait", 0) + start - queued
+        return result
+
+    def stats(self):
+        """Number of hashes and checks in this process, their total and mean durations, and the time
+        spent waiting"""
+        with self._stats_lock:
+            return {
+                "log_rounds": self.log_rounds,
+                "operations": {
+                    name: {
+                        "calls": calls,
+                        "seconds": self.seconds[name],
+                        "mean_seconds": self.seconds[name] / calls,
+                        "mean_wait_seconds": self.wait_seconds[name] / calls
+                    }
+                    for name, calls in self.calls.items()
+                },
+                "rejected": self.rejected
+            }
@@ -1,21 +1,141 @@
 from habit_tracker import db
 from datetime import datetime, date, timedelta
 from habit_tracker import login_manager
+from habit_tracker.cache import CompletionBitmap, completion_cache, user_cache
+from flask import request
 from flask_login import UserMixin
+from mongoengine.errors import NotUniqueError
+from mongoengine.queryset.visitor import Q
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from slugify import slugify
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 from enum import Enum
+from time import sleep
+import numpy as np
+import re
+from habit_tracker.intervals import find_interval, set_day
+
+
+# Time after which a habit's streak lock expires if the process holding it hasn't released it
+STREAK_LOCK_TIMEOUT = timedelta(seconds=5)
+
+# Time a process waits for another process to release a habit's streak lock before giving up, and the
+# shortest and longest pauses (seconds) between its attempts to take the lock
+STREAK_LOCK_WAIT = timedelta(seconds=1)
+STREAK_LOCK_MIN_DELAY = 0.005
+STREAK_LOCK_MAX_DELAY = 0.1
+
+# HabitStreaks aren't written if the streak lock expires within this time, since another process could
+# take the lock while they're being written
+STREAK_LOCK_MARGIN = timedelta(seconds=1)
+
+# Number of times a habit is saved with a newly generated slug if another habit took it first
+SLUG_ATTEMPTS = 3
 
 
 # Required by Flask-login
 @login_manager.user_loader
 def load_user(user_id):
-    """Callback for reloading a user object from the user id stored in the session"""
-    return User.objects(pk=user_id).first()
+    """Callback for reloading a user object from the user id stored in the session.
+
+    Users are cached for a short time, so most requests don't need to query the database. Each request
+    gets its own User object built from the cached raw document. The cache is per process, so requests
+    that can change data always read the user from the database, in case another process changed or
+    deleted them.
+    """
+    son = user_cache.get(user_id) if request.method in ("GET", "HEAD") else None
+    if son is None:
+        son = User.objects(pk=user_id).as_pymongo().first()
+        if son is None:
+            return None
+        user_cache.set(user_id, son)
+    return User._from_son(son)
 
 
 class User(db.Document, UserMixin):
     email = db.StringField(max_length=120, unique=True, required=True)
     password = db.StringField(max_length=60, required=True)
+    data_version = db.IntField(default=0)
+    """Incremented whenever any of the user's habits or streaks change, used to key cached fragments"""
+
+    grid_version = db.IntField(default=0)
+    """Incremented whenever a change may affect the user's history grid in any year, e.g. a new habit"""
+
+    grid_year_versions = db.DictField()
+    """Maps years (as strings) to a version that is incremented whenever completions in that year
+    change"""
+
+    def get_data_version(self):
+        """Read the user's current data version from the database, since the cached user may be stale"""
+        return User.objects(id=self.id).scalar("data_version").first() or 0
+
+    def get_versions(self):
+        """Read the user's current data and history grid versions with one query.
+
+        Returns:
+            dict: The user's "data_version", "grid_version", and "grid_year_versions".
+        """
+        versions = User.objects(id=self.id).only("data_version", "grid_version", "grid_year_versions") \
+                       .as_pymongo().first() or {}
+        return {
+            "data_version": versions.get("data_version", 0),
+            "grid_version": versions.get("grid_version", 0),
+            "grid_year_versions": versions.get("grid_year_versions", {})
+        }
+
+    @staticmethod
+    def increment_data_version(user_ids, years=None):
+        """Increment the data version of one or more users after changing their habits or streaks.
+
+        Args:
+            user_ids (ObjectId or iterable[ObjectId]): Ids of the users.
+            years (iterable[int], optional): Years whose history grids changed. Defaults to None,
+                                             meaning the change may affect the history grid of any
+                                             year.
+        """
+        if not isinstance(user_ids, (list, set, tuple)):
+            user_ids = [user_ids]
+        if years is None:
+            grid_versions = {"inc__grid_version": 1}
+        else:
+            grid_versions = {f"inc__grid_year_versions__{year}": 1 for year in years}
+        User.objects(id__in=list(user_ids)).update(inc__data_version=1, **grid_versions)
+
+    def uncache(self):
+        """Remove the user from this process's user cache, e.g. after their email or password changed"""
+        user_cache.pop(str(self.id))
+
+    def delete(self, defer=None):
+        """Delete the user with all of their habits, streaks, and daily rollups.
+
+        Each collection is cleared with a single `delete_many` rather than through the cascading delete
+        rules, which would load the user's habits to find their streaks.
+
+        Args:
+            defer (callable, optional): Called with a function that deletes the user's habits, streaks,
+                                        and rollups, e.g. to run it after the response is sent. The user
+                                        is deleted first so they can no longer log in. Defaults to None,
+                                        which deletes everything right away, starting with the habits.
+        """
+        user_id = self.id
+
+        def delete_data():
+            habit_ids = list(Habit.objects(user=user_id).scalar("id"))
+            # Streaks are deleted by habit, which is indexed, before the habits themselves
+            HabitStreak._get_collection().delete_many({"habit": {"$in": habit_ids}})
+            DailyRollup._get_collection().delete_many({"user": user_id})
+            Habit._get_collection().delete_many({"user": user_id})
+            for habit_id in habit_ids:
+                completion_cache.pop(habit_id)
+
+        self.uncache()
+        if defer is None:
+            delete_data()
+        User._get_collection().delete_one({"_id": user_id})
+        if defer is not None:
+            defer(delete_data)
 
     def __repr__(self):
         return f"User(email='{self.email}')"
@@ -27,28 +147,135 @@ class HabitStatus(Enum):
     INACTIVE = 3
 
 
+class HabitStats(db.EmbeddedDocument):
+    """Statistics of a habit's streaks, which are kept up to date whenever the streaks change"""
+
+    total_completions = db.IntField(default=0)
+    best_streak = db.IntField(default=0)
+
+    last_streak_start = db.DateTimeField()
+    """Inclusive start date of the habit's most recent streak"""
+
+    last_streak_end = db.DateTimeField()
+    """Inclusive end date of the habit's most recent streak"""
+
+    @classmethod
+    def from_streaks(cls, streaks):
+        """Calculate stats from (start, end) datetime tuples of all of a habit's streaks"""
+        stats = cls()
+        for start, end in streaks:
+            length = (end - start).days + 1
+            stats.total_completions += length
+            stats.best_streak = max(stats.best_streak, length)
+            if stats.last_streak_end is None or end > stats.last_streak_end:
+                stats.last_streak_start, stats.last_streak_end = start, end
+        return stats
+
+    def current_streak(self, my_date=None):
+        """Length of the streak that is still going on a date, i.e. that ended on it or the day before.
+
+        Args:
+            my_date (datetime.date, optional): Defaults to date.today().
+
+        Returns:
+            int: Number of days in the streak, or 0 if the habit wasn't completed on either day.
+        """
+        my_date = my_date or date.today()
+        if self.last_streak_end is None or self.last_streak_end.date() < my_date - timedelta(1):
+            return 0
+        return (self.last_streak_end - self.last_streak_start).days + 1
+
+
+class StreakConflict(Exception):
+    """Raised when a habit's streaks were changed by another process while they were being updated,
+    e.g. because the streak lock expired. The change may have been partly written."""
+
+
+class _StreakUpdate:
+    """Changes made to a habit while holding its streak lock, which are saved when it's released"""
+
+    __slots__ = ("changes", "stats", "lock", "intervals", "saved_intervals", "save_intervals", "merged",
+                 "version", "first_day", "user_id", "active")
+
+    def __init__(self, locked_habit, lock, user_id):
+        # Maps each datetime.date that was set as complete (True) or incomplete (False) to its status
+        self.changes = {}
+        # HabitStats after the changes, or None if they haven't been calculated
+        self.stats = locked_habit.stats
+        # Expiry time of the lock, which identifies it
+        self.lock = lock
+        # The habit's embedded streak intervals, and the ones read when the lock was taken
+        self.intervals = self.saved_intervals = locked_habit.streak_intervals
+        # Whether the embedded streak intervals are saved when the lock is released
+        self.save_intervals = False
+        # Whether streaks were merged without changing any dates
+        self.merged = False
+        # Version of the habit when the lock was taken
+        self.version = locked_habit.version
+        self.first_day = locked_habit.date_created.date()
+        self.user_id = user_id
+        # Whether the changes are counted in the user's daily rollups, which only count active habits
+        self.active = locked_habit.active
+
+    def set_intervals(self, intervals):
+        """Set the habit's embedded streak intervals, which are saved when the lock is released"""
+        self.intervals = intervals
+        self.save_intervals = True
+
+
 class Habit(db.Document):
     name = db.StringField(max_length=30, unique=False, required=True)
     slug = db.StringField()
     user = db.ReferenceField(User, required=True, reverse_delete_rule=db.CASCADE, unique_with="name")
     active = db.BooleanField(default=True)
     date_created = db.DateTimeField(default=lambda: datetime.today())
+    version = db.IntField(default=0)
+    """Incremented whenever the habit's streaks change, used to detect out of date cached data"""
+
+    streak_lock = db.DateTimeField()
+    """Expiry time (UTC) of the lock held by a process that is changing the habit's streaks"""
+
+    stats = db.EmbeddedDocumentField(HabitStats)
+    """Updated with the streaks so stats can be shown without querying them. None until first
+    calculated."""
+
+    year_versions = db.DictField()
+    """Maps years (as strings) to a version that is incremented whenever the habit's completions in that
+    year change, used to key cached history grids of past years"""
+
+    streak_intervals = db.ListField(db.ListField(db.DateTimeField()))
+    """Sorted [start, end] dates of the habit's streaks, used instead of HabitStreak documents when the
+    streak storage is "embedded" """
+
+    streak_storage = "collection"
+    """Where streaks are stored: "collection" for HabitStreak documents or "embedded" for the
+    `streak_intervals` of each habit. Set from the STREAK_STORAGE config value."""
 
     meta = {
         "indexes": [
             "user",  # used as a filter in nearly all Habit queries
-            "date_created"  # used for ordering habits in checklist
+            "date_created",  # used for ordering habits in checklist
+            # habits are looked up by slug, which must be unique for each user
+            {"fields": ("user", "slug"), "unique": True}
         ]
     }
 
     def set_unique_slug(self):
-        """Set a unique url-friendly slug based on the habit name"""
+        """Set a unique url-friendly slug based on the habit name.
+
+        Slugs are the slugified name followed by the lowest number that the user's other habits with
+        the same slugified name don't use. Those slugs are all found with one prefix query on the
+        (user, slug) index.
+        """
+        prefix = slugify(self.name) + "-"
+        habits = Habit.objects(user=self.user, slug=re.compile("^" + re.escape(prefix) + r"\d+$"))
+        if self.id is not None:
+            habits = habits(id__ne=self.id)
+        used = {int(slug[len(prefix):]) for slug in habits.scalar("slug")}
         increment = 0
-        slug = slugify(self.name) + "-" + str(increment)
-        while Habit.objects(user=self.user, slug=slug):
+        while increment in used:
             increment += 1
-            slug = slugify(self.name) + "-" + str(increment)
-        self.slug = slug
+        self.slug = prefix + str(increment)
 
     def clean(self):
         """Perform validation / data cleaning that is run when document is saved"""
@@ -56,6 +283,108 @@ class Habit(db.Document):
         if self.slug is None:
             self.set_unique_slug()
 
+    def save(self, *args, **kwargs):
+        """Save the habit, choosing another slug if a concurrent save took the one that was generated"""
+        generate_slug = self.slug is None
+        for attempt in range(SLUG_ATTEMPTS):
+            try:
+                result = super().save(*args, **kwargs)
+                User.increment_data_version(self.user_id)
+                return result
+            except NotUniqueError:
+                other_habits = Habit.objects(user=self.user, slug=self.slug)
+                if self.id is not None:
+                    other_habits = other_habits(id__ne=self.id)
+                slug_taken = generate_slug and other_habits.first() is not None
+                if not slug_taken or attempt == SLUG_ATTEMPTS - 1:
+                    raise
+                self.slug = None
+
+    @classmethod
+    def get_completion_bitmaps(cls, habits):
+        """Get the completion bitmaps of several habits.
+
+        Bitmaps are taken from the completion cache when they are up to date with the habit's
+        version. The rest are built from the habits' streaks, which are fetched with a single query,
+        or are already loaded if the streaks are embedded in the habits.
+
+        Args:
+            habits (iterable): Habit document objects.
+
+        Returns:
+            dict: Maps each habit id to its CompletionBitmap.
+        """
+        bitmaps = {}
+        missing = {}
+        for habit in habits:
+            bitmap = completion_cache.get(habit.id)
+            if bitmap is not None and bitmap.version == habit.version \
+                    and bitmap.first_day == habit.date_created.date():
+                bitmaps[habit.id] = bitmap
+            else:
+                missing[habit.id] = CompletionBitmap(habit.date_created.date(), habit.version)
+        if missing and cls.streak_storage == "embedded":
+            # Embedded streaks were loaded with the habits, at the same version
+            for habit in habits:
+                if habit.id in missing:
+                    for start, end in habit.streak_intervals:
+                        missing[habit.id].set_range(start.date(), end.date(), True)
+        elif missing:
+            streaks = HabitStreak.objects(habit__in=list(missing)).only("habit", "start", "end") \
+                                 .as_pymongo()
+            for streak in streaks:
+                missing[streak["habit"]].set_range(streak["start"].date(), streak["end"].date(), True)
+        if missing:
+            for habit_id, bitmap in missing.items():
+                completion_cache.set(habit_id, bitmap)
+            bitmaps.update(missing)
+        return bitmaps
+
+    def get_completion_bitmap(self, update=None):
+        """Get the habit's CompletionBitmap, which is only loaded from the database if it isn't cached.
+
+        Args:
+            update (_StreakUpdate, optional): Held streak lock of the habit, whose version, creation
+                                              date, and embedded streaks were read when it was taken.
+                                              Defaults to None, meaning those of this copy of the habit
+                                              are used.
+        """
+        if update is None:
+            return Habit.get_completion_bitmaps([self])[self.id]
+        bitmap = completion_cache.get(self.id)
+        if bitmap is None or bitmap.version != update.version or bitmap.first_day != update.first_day:
+            if self.streak_storage == "embedded":
+                streaks = update.intervals
+            else:
+                streaks = Habit.get_streaks([self.id])[self.id]
+            bitmap = CompletionBitmap(
+                update.first_day, update.version, ((start.date(), end.date()) for start, end in streaks)
+            )
+            completion_cache.set(self.id, bitmap)
+        return bitmap
+
+    @classmethod
+    def get_streaks(cls, habit_ids):
+        """Read the streaks of several habits with a single query, from either streak storage.
+
+        Args:
+            habit_ids (iterable[ObjectId]): Ids of the habits.
+
+        Returns:
+            dict: Maps each habit id to a list of (start, end) datetime tuples of its streaks.
+        """
+        habit_ids = list(habit_ids)
+        streaks = {habit_id: [] for habit_id in habit_ids}
+        if cls.streak_storage == "embedded":
+            for habit in Habit.objects(id__in=habit_ids).only("streak_intervals").as_pymongo():
+                intervals = habit.get("streak_intervals", [])
+                streaks[habit["_id"]] = [(start, end) for start, end in intervals]
+        else:
+            raw_streaks = HabitStreak.objects(habit__in=habit_ids).only("habit", "start", "end")
+            for streak in raw_streaks.as_pymongo():
+                streaks[streak["habit"]].append((streak["start"], streak["end"]))
+        return streaks
+
     def is_active_date(self, my_date):
         """Check if a habit is active on a given date"""
         return self.date_created.date() <= my_date <= date.today()
@@ -71,13 +400,8 @@ class Habit(db.Document):
         """
         if not self.is_active_date(my_date):
             return HabitStatus.INACTIVE
-        date_with_time = datetime.combine(my_date, datetime.min.time())
-        streak = HabitStreak.objects(
-            habit=self.id,
-            start__lte=date_with_time,
-            end__gte=date_with_time
-        ).first()
-        return HabitStatus.COMPLETE if streak is not None else HabitStatus.INCOMPLETE
+        complete = self.get_completion_bitmap()[my_date]
+        return HabitStatus.COMPLETE if complete else HabitStatus.INCOMPLETE
 
     def get_completion_status_range(self, start_date, end_date):
         """Get a list of habit completion statuses between a start and end date.
@@ -89,107 +413,811 @@ class Habit(db.Document):
         Returns:
             list[HabitStatus]: List containing completion status of a habit for the range of dates.
         """
-        start_date = datetime.combine(start_date, datetime.min.time())
-        end_date = datetime.combine(end_date, datetime.min.time())
-        # List has incomplete status as default
-        completion_list = [HabitStatus.INCOMPLETE] * ((end_date - start_date).days + 1)
-        streaks = HabitStreak.objects(
-            habit=self.id,
-            start__lte=end_date,
-            end__gte=start_date
-        )
-        # Replace those that are complete
-        for streak in streaks:
-            start = max(0, (streak.start - start_date).days)
-            end = min(len(completion_list), (streak.end - start_date).days + 1)
-            completion_list[start:end] = [HabitStatus.COMPLETE] * (end - start)
+        completion_list = [
+            HabitStatus.COMPLETE if complete else HabitStatus.INCOMPLETE
+            for complete in self.get_completion_bitmap().range(start_date, end_date)
+        ]
         # Replace those that are inactive
-        if not self.is_active_date(start_date.date()):
-            inactive_days = (self.date_created.date() - start_date.date()).days
+        if not self.is_active_date(start_date):
+            inactive_days = (self.date_created.date() - start_date).days
             completion_list[:inactive_days] = [HabitStatus.INACTIVE] * inactive_days
         return completion_list
 
-    def set_complete(self, my_date):
-        """Set a habit as complete on a given date"""
-        if (not self.is_active_date(my_date) or
-                self.get_completion_status(my_date) == HabitStatus.COMPLETE):
+    @property
+    def user_id(self):
+        """Id of the user that owns the habit, which is read without fetching the User document"""
+        return self._fields["user"].to_mongo(self._data["user"])
+
+    @contextmanager
+    def _streak_lock(self):
+        """Context manager that stops other processes from changing the habit's streaks.
+
+        It locks the habit with `_streak_locks` and yields its _StreakUpdate. The habit's version,
+        stats, and embedded streaks are updated with what was saved when the lock is released. If the
+        streaks were changed by another process while the lock was held, they're compacted once it's
+        released.
+        """
+        updates = {}
+        try:
+            with Habit._streak_locks({self.id: self.user_id}) as updates:
+                yield updates[self.id]
+        except StreakConflict:
+            if updates:
+                # Merge any streaks that the partly written change left overlapping
+                Habit.compact_streaks([{"_id": self.id, "user": self.user_id}], repair=True)
+            raise
+        finally:
+            update = updates.get(self.id)
+            if update is not None:
+                self.version = update.version
+                # Set without marking the fields as changed, since they were already saved
+                self._data["stats"] = update.stats
+                self._data["streak_intervals"] = update.intervals
+
+    @staticmethod
+    @contextmanager
+    def _streak_locks(habits, wait=True):
+        """Context manager that stops other processes from changing the streaks of several habits.
+
+        Each lock is a lease stored in the habit document, so it's released automatically if the
+        process holding it dies. A single habit is locked with one `modify`, waiting up to
+        STREAK_LOCK_WAIT for another process to release it. Without `wait`, several habits are locked
+        with one update and the ones that are already locked are skipped.
+
+        It yields a dict mapping the id of each locked habit to a _StreakUpdate, which the caller fills
+        with the dates that it sets as complete or incomplete, the updated stats, and the updated
+        embedded streaks. The locks are released with `_release_streak_locks`, which saves them.
+
+        Args:
+            habits (dict): Maps the ids of the habits to the ids of their users.
+            wait (bool, optional): Whether to wait for the lock of a single habit. Defaults to True.
+
+        Raises:
+            StreakConflict: If the habit was still locked by another process after waiting.
+            Habit.DoesNotExist: If the habit that was waited for doesn't exist.
+        """
+        fields = ("version", "stats", "streak_intervals", "date_created", "active")
+        if wait:
+            (habit_id,) = habits
+            give_up_time = datetime.utcnow() + STREAK_LOCK_WAIT
+            delay = STREAK_LOCK_MIN_DELAY
+            while True:
+                now = datetime.utcnow()
+                expiry = Habit._lock_expiry(now)
+                locked_habit = Habit.objects(
+                    Q(id=habit_id) & (Q(streak_lock=None) | Q(streak_lock__lt=now))
+                ).only(*fields).modify(set__streak_lock=expiry, new=True)
+                if locked_habit is not None:
+                    locked_habits = [locked_habit]
+                    break
+                if now > give_up_time:
+                    if Habit.objects(id=habit_id).first() is None:
+                        raise Habit.DoesNotExist(f"Habit {habit_id} could not be locked.")
+                    raise StreakConflict(f"Habit {habit_id} is locked by another process.")
+                # Back off, so a habit with a lock held by a stalled process isn't polled constantly
+                sleep(delay)
+                delay = min(2 * delay, STREAK_LOCK_MAX_DELAY)
+        else:
+            now = datetime.utcnow()
+            expiry = Habit._lock_expiry(now)
+            Habit.objects(
+                Q(id__in=list(habits)) & (Q(streak_lock=None) | Q(streak_lock__lt=now))
+            ).update(set__streak_lock=expiry)
+            locked_habits = Habit.objects(id__in=list(habits), streak_lock=expiry).only(*fields)
+
+        updates = {habit.id: _StreakUpdate(habit, expiry, habits[habit.id]) for habit in locked_habits}
+        failed = False
+        try:
+            yield updates
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            Habit._release_streak_locks(updates, failed)
+
+    @staticmethod
+    def _release_streak_locks(updates, failed):
+        """Release streak locks taken by `_streak_locks`, saving the changes made while they were held.
+
+        The locks are released with one bulk write, which also saves the habits' stats and embedded
+        streaks and increments the versions of the habits that changed. After that, the daily rollups
+        and the data versions of the users are updated, and the cached completion bitmaps are patched
+        with the changed dates. Each _StreakUpdate is left with the habit's saved version, stats, and
+        embedded streaks.
+
+        Args:
+            updates (dict): Maps habit ids to the _StreakUpdates yielded by `_streak_locks`.
+            failed (bool): Whether the changes may have only been partly made, in which case the stats
+                           are unset so they're recalculated later, and embedded streaks aren't saved.
+
+        Raises:
+            StreakConflict: If a lock expired before the embedded streaks that were changed were saved.
+        """
+        if not updates:
+            return
+        operations = []
+        for habit_id, update in updates.items():
+            changed = failed or bool(update.changes) or update.merged
+            operation = {
+                "$unset": {"streak_lock": True}, "$inc": {"version": 1 if changed else 0}, "$set": {}
+            }
+            if failed:
+                operation["$unset"]["stats"] = True
+            elif update.stats is not None:
+                operation["$set"]["stats"] = update.stats.to_mongo()
+            if update.save_intervals and not failed:
+                operation["$set"]["streak_intervals"] = update.intervals
+            for year in {my_date.year for my_date in update.changes} if not failed else ():
+                operation["$inc"][f"year_versions.{year}"] = 1
+            if not operation["$set"]:
+                del operation["$set"]
+            operations.append(UpdateOne({"_id": habit_id, "streak_lock": update.lock}, operation))
+        result = Habit._get_collection().bulk_write(operations, ordered=False)
+        released = result.matched_count == len(operations)
+
+        rollup_counts = defaultdict(Counter)
+        changed_users = set()
+        changed_years = set()
+        lost = False
+        for habit_id, update in updates.items():
+            changed = failed or bool(update.changes) or update.merged
+            # Embedded streaks are only saved with the lock, so they're lost if it expired
+            saved = not failed and (released or not update.save_intervals)
+            lost = lost or (update.save_intervals and not failed and not released)
+            if saved and update.active:
+                for my_date, complete in update.changes.items():
+                    rollup_counts[update.user_id][my_date] += 1 if complete else -1
+            if changed:
+                changed_users.add(update.user_id)
+                changed_years.update(my_date.year for my_date in update.changes)
+
+            bitmap = completion_cache.get(habit_id)
+            if changed and released and saved and bitmap is not None \
+                    and bitmap.version == update.version and bitmap.first_day == update.first_day:
+                for my_date, complete in update.changes.items():
+                    bitmap[my_date] = complete
+                bitmap.version = update.version + 1
+                # Set again because the bitmap may have grown
+                completion_cache.set(habit_id, bitmap)
+            elif changed:
+                completion_cache.pop(habit_id)
+
+            update.version += 1 if changed else 0
+            if failed:
+                update.stats = None
+            if not saved:
+                update.intervals = update.saved_intervals
+
+        for user_id, counts in rollup_counts.items():
+            DailyRollup.increment(user_id, counts)
+        if changed_users:
+            # Any year may have changed if the changes were only partly made
+            User.increment_data_version(changed_users, years=changed_years if not failed else None)
+        if lost:
+            raise StreakConflict("A streak lock expired before the streaks were saved.")
+
+    @staticmethod
+    def _lock_expiry(now):
+        """Expiry time of a streak lock taken at `now`, which also identifies the lock holder, so it's
+        rounded to the millisecond precision of Mongo"""
+        return (now + STREAK_LOCK_TIMEOUT).replace(microsecond=now.microsecond // 1000 * 1000)
+
+    def _set_completion(self, my_date, complete=None):
+        """Set a habit as complete or incomplete on a given date.
+
+        The streaks next to the date are found in the habit's CompletionBitmap and updated with one
+        conditional bulk write while holding the habit's streak lock, so concurrent changes can't leave
+        overlapping streaks. The bitmap is only read from the database if the cached one is out of
+        date. Embedded streaks are read when the lock is taken and saved when it's released.
+
+        Args:
+            my_date (datetime.date): Date on which the habit's completion is set.
+            complete (bool, optional): Whether the habit is complete on the date. Defaults to None,
+                                       which toggles the current completion status.
+        """
+        if not self.is_active_date(my_date):
             return
         date_with_time = datetime.combine(my_date, datetime.min.time())
-        previous_day = date_with_time - timedelta(1)
-        next_day = date_with_time + timedelta(1)
-        left_streak = HabitStreak.objects(habit=self.id, end=previous_day).first()
-        right_streak = HabitStreak.objects(habit=self.id, start=next_day).first()
 
-        # Add date to new or existing HabitStreak
+        with self._streak_lock() as update:
+            if self.streak_storage == "embedded":
+                if complete is None:
+                    complete = find_interval(update.intervals, date_with_time) is None
+                intervals = set_day(update.intervals, date_with_time, complete)
+                if intervals is update.intervals:
+                    return
+                update.set_intervals(intervals)
+                update.changes[my_date] = complete
+                update.stats = HabitStats.from_streaks(intervals)
+                return
+
+            # Streak containing the date and/or the streaks on either side of it
+            bitmap = self.get_completion_bitmap(update)
+            streak, left_streak, right_streak = bitmap.neighbours(my_date)
+
+            if complete is None:
+                complete = streak is None
+            if complete == (streak is not None):
+                return
+
+            if complete:
+                operations = self._complete_operations(date_with_time, left_streak, right_streak)
+            else:
+                operations = self._incomplete_operations(date_with_time, streak)
+            self._write_streaks(update.lock, operations)
+            update.changes[my_date] = complete
+            # The cached bitmap is patched with the other changes when the lock is released
+            bitmap[my_date] = complete
+            update.stats = self._updated_stats(
+                update.stats, date_with_time, streak, left_streak, right_streak, bitmap
+            )
+
+    def _updated_stats(self, stats, date_with_time, streak, left_streak, right_streak, bitmap):
+        """Get the habit's stats after a date was set as complete or incomplete.
+
+        The stats are updated from the streaks next to the date. The habit's CompletionBitmap is only
+        searched when its best or most recent streak was shortened.
+
+        Args:
+            stats (HabitStats): Stats before the change, or None if they haven't been calculated.
+            date_with_time (datetime): Date that was changed.
+            streak (dict): Raw HabitStreak that contained the date if it was set as incomplete,
+                           otherwise None.
+            left_streak (dict): Raw HabitStreak ending the day before the date, if any.
+            right_streak (dict): Raw HabitStreak starting the day after the date, if any.
+            bitmap (CompletionBitmap): The habit's completions after the change.
+
+        Returns:
+            HabitStats: Updated stats.
+        """
+        if stats is None:
+            return self._calculate_stats()
+        total = stats.total_completions
+        best = stats.best_streak
+        last_start, last_end = stats.last_streak_start, stats.last_streak_end
+
+        if streak is None:
+            # Date was set as complete, joining any streaks on either side of it
+            start = left_streak["start"] if left_streak is not None else date_with_time
+            end = right_streak["end"] if right_streak is not None else date_with_time
+            total += 1
+            best = max(best, (end - start).days + 1)
+            if last_end is None or end >= last_end:
+                last_start, last_end = start, end
+        else:
+            total -= 1
+            if (streak["end"] - streak["start"]).days + 1 == best:
+                best = bitmap.longest()
+            if streak["end"] == last_end:
+                if date_with_time < streak["end"]:
+                    last_start = date_with_time + timedelta(1)
+                elif date_with_time > streak["start"]:
+                    last_end = date_with_time - timedelta(1)
+                else:
+                    latest = bitmap.latest()
+                    if latest is not None:
+                        last_start, last_end = latest["start"], latest["end"]
+                    else:
+                        last_start, last_end = None, None
+
+        return HabitStats(
+            total_completions=total,
+            best_streak=best,
+            last_streak_start=last_start,
+            last_streak_end=last_end
+        )
+
+    def _calculate_stats(self):
+        """Calculate the habit's stats from all of its streaks"""
+        return HabitStats.from_streaks(Habit.get_streaks([self.id])[self.id])
+
+    def _read_streaks(self, update, first_date=None, last_date=None):
+        """Read the habit's streaks that overlap or touch a range of dates, holding its streak lock.
+
+        Args:
+            update (_StreakUpdate): Yielded by the streak lock.
+            first_date (datetime.date, optional): Inclusive start of the range. Defaults to None,
+                                                  meaning all of the habit's streaks are read.
+            last_date (datetime.date, optional): Inclusive end of the range.
+
+        Returns:
+            dict: Maps (start, end) datetime.date tuples of the streaks to their HabitStreak ids, which
+                  are None for embedded streaks.
+        """
+        if self.streak_storage == "embedded":
+            return {
+                (start.date(), end.date()): None
+                for start, end in update.intervals
+                if first_date is None or (start.date() <= last_date + timedelta(1)
+                                          and end.date() >= first_date - timedelta(1))
+            }
+        streaks = HabitStreak.objects(habit=self.id)
+        if first_date is not None:
+            streaks = streaks.filter(
+                start__lte=datetime.combine(last_date + timedelta(1), datetime.min.time()),
+                end__gte=datetime.combine(first_date - timedelta(1), datetime.min.time())
+            )
+        return {
+            (streak["start"].date(), streak["end"].date()): streak["_id"]
+            for streak in streaks.only("start", "end").as_pymongo()
+        }
+
+    def _replace_streaks(self, update, existing_streaks, merged_streaks, storage=None):
+        """Replace streaks read with `_read_streaks` by the streaks they were merged into.
+
+        Only the streaks that changed are deleted and inserted, with one bulk write, or the embedded
+        intervals are saved when the streak lock is released.
+
+        Args:
+            update (_StreakUpdate): Yielded by the streak lock.
+            existing_streaks (dict): Returned by `_read_streaks`.
+            merged_streaks (set): (start, end) datetime.date tuples of the streaks that replace them.
+            storage (str, optional): Streak storage that the streaks are written to. Defaults to None,
+                                     meaning the configured `streak_storage`.
+
+        Returns:
+            list: (start, end) datetime tuples of all of the habit's streaks if they're embedded,
+                  otherwise None.
+        """
+        def with_time(day):
+            return datetime.combine(day, datetime.min.time())
+
+        if (storage or self.streak_storage) == "embedded":
+            kept = [
+                [start, end] for start, end in update.intervals
+                if (start.date(), end.date()) not in existing_streaks
+            ]
+            added = [[with_time(start), with_time(end)] for start, end in merged_streaks]
+            intervals = sorted(kept + added)
+            update.set_intervals(intervals)
+            return intervals
+
+        operations = [
+            DeleteOne({"_id": streak_id, "start": with_time(start), "end": with_time(end)})
+            for (start, end), streak_id in existing_streaks.items()
+            if (start, end) not in merged_streaks
+        ]
+        operations += [
+            InsertOne(self._new_streak(with_time(start), with_time(end)))
+            for start, end in sorted(merged_streaks)
+            if (start, end) not in existing_streaks
+        ]
+        if operations:
+            # Old streaks are deleted first because the new streaks may have the same start dates
+            self._write_streaks(update.lock, operations)
+        return None
+
+    def _complete_operations(self, date_with_time, left_streak, right_streak):
+        """Get the bulk write operations that add a date to new or existing HabitStreaks"""
         if left_streak is not None:
             if right_streak is not None:
-                # Combine two streaks that meet at the date argument
-                left_streak.end = right_streak.end
-                right_streak.delete()
-            else:
-                # Combine date with only left_streak
-                left_streak.end = date_with_time
-            left_streak.save()
+                # Combine two streaks that meet at the date argument.
+                # The left streak is extended before the right one is deleted, so a partial failure
+                # can't lose any completed dates.
+                return [
+                    UpdateOne(self._streak_filter(left_streak), {"$set": {
+                        "end": right_streak["end"],
+                        "streak_length": (right_streak["end"] - left_streak["start"]).days + 1
+                    }}),
+                    DeleteOne(self._streak_filter(right_streak))
+                ]
+            # Combine date with only left_streak
+            return [UpdateOne(self._streak_filter(left_streak), {"$set": {
+                "end": date_with_time,
+                "streak_length": (date_with_time - left_streak["start"]).days + 1
+            }})]
         elif right_streak is not None:
             # Combine date with only right_streak
-            right_streak.start = date_with_time
-            right_streak.save()
-        else:
-            # Create new streak
-            HabitStreak(start=date_with_time, end=date_with_time, habit=self.id).save()
+            return [UpdateOne(self._streak_filter(right_streak), {"$set": {
+                "start": date_with_time,
+                "streak_length": (right_streak["end"] - date_with_time).days + 1
+            }})]
+        # Create new streak
+        return [InsertOne(self._new_streak(date_with_time, date_with_time))]
+
+    def _incomplete_operations(self, date_with_time, streak):
+        """Get the bulk write operations that remove a date from the HabitStreak that contains it"""
+        if date_with_time == streak["start"]:
+            if date_with_time == streak["end"]:
+                # Delete one-day streak
+                return [DeleteOne(self._streak_filter(streak))]
+            # Remove date at start of a multi-day streak
+            return [UpdateOne(self._streak_filter(streak), {"$set": {
+                "start": date_with_time + timedelta(1),
+                "streak_length": (streak["end"] - date_with_time).days
+            }})]
+        elif date_with_time == streak["end"]:
+            # Remove date at end of a multi-day streak
+            return [UpdateOne(self._streak_filter(streak), {"$set": {
+                "end": date_with_time - timedelta(1),
+                "streak_length": (date_with_time - streak["start"]).days
+            }})]
+        # Remove date from within a multi-day streak, i.e. split streak into two streaks
+        return [
+            UpdateOne(self._streak_filter(streak), {"$set": {
+                "end": date_with_time - timedelta(1),
+                "streak_length": (date_with_time - streak["start"]).days
+            }}),
+            InsertOne(self._new_streak(date_with_time + timedelta(1), streak["end"]))
+        ]
+
+    def _streak_filter(self, streak):
+        """Filter matching one of the habit's HabitStreaks by its start date, which is unique per habit,
+        but only if it hasn't changed since it was read"""
+        return {"habit": self.id, "start": streak["start"], "end": streak["end"]}
+
+    def _new_streak(self, start, end):
+        """Create the raw document of a new HabitStreak for the habit, bypassing `HabitStreak.clean`"""
+        return HabitStreak.new_raw(self.id, self.user_id, start, end)
+
+    @staticmethod
+    def _write_streaks(lock, operations):
+        """Write changes to HabitStreaks with one ordered bulk write while holding streak locks.
+
+        Updates and deletes only match streaks that haven't changed since they were read. If another
+        process changed them, e.g. after the locks expired, fewer streaks are matched than expected.
+        Nothing is written if the locks are about to expire, and a delete that follows an update is only
+        written once the update matched, so a streak isn't deleted unless it was merged into another.
+
+        Args:
+            lock (datetime): Expiry time of the streak locks.
+            operations (list): pymongo UpdateOne, DeleteOne, and InsertOne operations.
+
+        Raises:
+            StreakConflict: If the locks were about to expire or the streaks had changed.
+        """
+        if datetime.utcnow() > lock - STREAK_LOCK_MARGIN:
+            raise StreakConflict("The streak lock expired before the streaks were written.")
+        batches = [[]]
+        for operation in operations:
+            updates_batched = any(isinstance(other, UpdateOne) for other in batches[-1])
+            if isinstance(operation, DeleteOne) and updates_batched:
+                batches.append([])
+            batches[-1].append(operation)
+
+        for batch in batches:
+            num_matches = sum(not isinstance(operation, InsertOne) for operation in batch)
+            try:
+                result = HabitStreak._get_collection().bulk_write(batch)
+            except BulkWriteError as error:
+                # A new streak has the same start as one that another process wrote
+                raise StreakConflict("Streaks were written by another process.") from error
+            if result.matched_count + result.deleted_count < num_matches:
+                raise StreakConflict("Streaks were changed by another process after they were read.")
+
+    def set_complete(self, my_date):
+        """Set a habit as complete on a given date"""
+        # The status is checked while holding the streak lock, since this copy of the habit may be stale
+        self._set_completion(my_date, True)
 
     def set_incomplete(self, my_date):
         """Set a habit as incomplete on a given date"""
-        if not self.is_active_date(my_date):
-            return
-        date_with_time = datetime.combine(my_date, datetime.min.time())
-        streak = HabitStreak.objects(
-            habit=self.id,
-            start__lte=date_with_time,
-            end__gte=date_with_time
-        ).first()
-        if not streak:
-            return
+        self._set_completion(my_date, False)
 
-        # Remove date from the HabitStreak that contains it
-        if date_with_time == streak.start:
-            if date_with_time == streak.end:
-                # Delete one-day streak
-                streak.delete()
+    def toggle_complete(self, my_date):
+        """Set a habit as completed if it is currently incomplete, otherwise set it as incomplete"""
+        self._set_completion(my_date)
+
+    def add_completions(self, completed):
+        """Set a habit as complete on many dates at once.
+
+        The habit's streaks are merged with the completed dates in memory and written with a single bulk
+        write, which only deletes and inserts the streaks that changed. If any of the dates are before
+        the habit was created, the habit's creation date is moved back to the earliest of them while
+        holding the streak lock.
+
+        Args:
+            completed (CompletionBitmap): Bitmap of the dates on which the habit was completed.
+
+        Returns:
+            int: Number of dates that weren't already complete.
+        """
+        first_streak = next(completed.streaks(), None)
+        if first_streak is None:
+            return 0
+        today = date.today()
+
+        with self._streak_lock() as update:
+            # The creation date read with the lock is used, since another process may have moved it back
+            first_day = min(update.first_day, first_streak[0])
+            date_created = datetime.combine(first_day, datetime.min.time())
+            moved = first_day < update.first_day
+            if moved:
+                # Only moved back, in case another process moved it back further without the lock
+                Habit.objects(id=self.id, date_created__gt=date_created).update_one(
+                    set__date_created=date_created
+                )
+                # Cached bitmaps start from the old creation date, so they're dropped when it's released
+                update.first_day = first_day
+            existing_streaks = self._read_streaks(update)
+            existing_days = CompletionBitmap(first_day, 0, existing_streaks).range(first_day, today)
+            completed_days = completed.range(first_day, today)
+            merged_streaks = set(
+                CompletionBitmap.from_array(first_day, 0, existing_days | completed_days).streaks()
+            )
+            self._replace_streaks(update, existing_streaks, merged_streaks)
+            for day in np.flatnonzero(completed_days & ~existing_days):
+                update.changes[first_day + timedelta(int(day))] = True
+            update.stats = HabitStats.from_streaks(
+                (
+                    datetime.combine(start, datetime.min.time()),
+                    datetime.combine(end, datetime.min.time())
+                )
+                for start, end in merged_streaks
+            )
+        # Set without marking the field as changed, since it was already saved
+        self._data["date_created"] = date_created
+        if moved:
+            # The years shown in the history grid start from the earliest creation date
+            User.increment_data_version(self.user_id)
+        return len(update.changes)
+
+    def set_completions(self, statuses):
+        """Set a habit as complete or incomplete on several dates with a single write.
+
+        Only the streaks that overlap or touch the range of changed dates are read, merged with the
+        new statuses in memory, and replaced where they changed. Dates on which the habit isn't active
+        are ignored.
+
+        Args:
+            statuses (dict): Maps datetime.date objects to whether the habit is complete on them.
+
+        Returns:
+            dict: Maps each date whose status changed to whether it is now complete.
+        """
+        statuses = {
+            my_date: complete for my_date, complete in statuses.items() if self.is_active_date(my_date)
+        }
+        if not statuses:
+            return {}
+        first_date, last_date = min(statuses), max(statuses)
+
+        with self._streak_lock() as update:
+            existing_streaks = self._read_streaks(update, first_date, last_date)
+            # Streaks may extend past either end of the changed dates, in which case they're kept whole
+            first_day = min([first_date] + [start for start, _ in existing_streaks])
+            last_day = max([last_date] + [end for _, end in existing_streaks])
+            completion = CompletionBitmap(first_day, 0, existing_streaks)
+            for my_date, complete in statuses.items():
+                if completion[my_date] != complete:
+                    update.changes[my_date] = complete
+            if not update.changes:
+                return {}
+            for my_date, complete in update.changes.items():
+                completion[my_date] = complete
+            merged = CompletionBitmap.from_array(first_day, 0, completion.range(first_day, last_day))
+            merged_streaks = set(merged.streaks())
+            intervals = self._replace_streaks(update, existing_streaks, merged_streaks)
+            # Several streaks may have changed, so the stats are recalculated rather than updated
+            if intervals is not None:
+                update.stats = HabitStats.from_streaks(intervals)
             else:
-                # Remove date at start of a multi-day streak
-                streak.start += timedelta(1)
-                streak.save()
-        elif date_with_time == streak.end:
-            # Remove date at end of a multi-day streak
-            streak.end -= timedelta(1)
-            streak.save()
+                update.stats = self._calculate_stats()
+        return dict(update.changes)
+
+    @staticmethod
+    def recalculate_stats(habits):
+        """Recalculate the stats of several habits from their streaks with one query and one bulk write.
+
+        A habit's stats aren't saved if its version changed after it was read, since its streaks
+        changed and its stats were already updated with them.
+
+        Args:
+            habits (iterable[dict]): Raw Habit documents with their "_id", "user", and "version", and
+                                     their "streak_intervals" if the streaks are embedded.
+
+        Returns:
+            int: Number of habits whose stats were saved.
+        """
+        habits = list(habits)
+        versions = {habit["_id"]: habit.get("version", 0) for habit in habits}
+        if Habit.streak_storage == "embedded":
+            streaks = {habit["_id"]: habit.get("streak_intervals", []) for habit in habits}
         else:
-            # Remove date from within a multi-day streak, i.e. split streak into two streaks
-            left_streak_end = date_with_time - timedelta(1)
-            right_streak_start = date_with_time + timedelta(1)
-            right_streak_end = streak.end
-            streak.end = left_streak_end
-            streak.save()
-            HabitStreak(start=right_streak_start, end=right_streak_end, habit=self.id).save()
+            streaks = Habit.get_streaks(versions)
+        operations = [
+            UpdateOne(
+                {"_id": habit_id, "version": versions[habit_id]},
+                {"$set": {"stats": HabitStats.from_streaks(habit_streaks).to_mongo()}}
+            )
+            for habit_id, habit_streaks in streaks.items()
+        ]
+        if not operations:
+            return 0
+        num_saved = Habit._get_collection().bulk_write(operations, ordered=False).matched_count
+        # Stats aren't shown in the history grid
+        User.increment_data_version({habit["user"] for habit in habits}, years=())
+        return num_saved
 
-    def toggle_complete(self, my_date):
-        """Set a habit as completed if it is currently incomplete, otherwise set it as incomplete"""
-        if not self.is_active_date(my_date):
-            return
-        if self.get_completion_status(my_date) == HabitStatus.COMPLETE:
-            self.set_incomplete(my_date)
+    @staticmethod
+    def compact_streaks(habits, repair=False):
+        """Find habits whose streaks overlap or touch, and merge their streaks if `repair` is set.
+
+        Streaks are merged whenever they change, but a change that was only partly written, e.g.
+        because another process took the streak lock, can leave them fragmented. The streaks of all of
+        the habits are read with one query. To repair them, the fragmented habits are locked with
+        `_streak_locks`, which skips the habits that other processes hold the locks of, and their
+        streaks are replaced with one bulk write.
+
+        Args:
+            habits (iterable[dict]): Raw Habit documents with their "_id" and "user".
+            repair (bool, optional): Whether to merge the fragmented streaks. Defaults to False.
+
+        Returns:
+            tuple: A dict mapping the id of each habit with fragmented streaks to its number of streaks
+                   before and after they're merged, and a list of the raw documents of the fragmented
+                   habits that were skipped because they were locked.
+        """
+        habits = {habit["_id"]: habit["user"] for habit in habits}
+
+        def merged_counts(streaks):
+            intervals = Habit._merged_intervals(sorted([start, end] for start, end in streaks))
+            return intervals, (len(streaks), len(intervals))
+
+        fragmented = {}
+        for habit_id, streaks in Habit.get_streaks(habits).items():
+            _, counts = merged_counts(streaks)
+            if counts[1] < counts[0]:
+                fragmented[habit_id] = counts
+        if not repair or not fragmented:
+            return fragmented, []
+
+        compacted = {}
+        locked = {habit_id: habits[habit_id] for habit_id in fragmented}
+        with Habit._streak_locks(locked, wait=False) as updates:
+            busy = [
+                {"_id": habit_id, "user": habits[habit_id]} for habit_id in fragmented
+                if habit_id not in updates
+            ]
+            # Streaks are read again, since they may have changed before the habits were locked
+            if Habit.streak_storage == "embedded":
+                existing = {habit_id: update.intervals for habit_id, update in updates.items()}
+            else:
+                existing = {habit_id: {} for habit_id in updates}
+                raw_streaks = HabitStreak.objects(habit__in=list(updates)).only("habit", "start", "end")
+                for streak in raw_streaks.as_pymongo():
+                    existing[streak["habit"]][(streak["start"], streak["end"])] = streak["_id"]
+
+            deletes, inserts = [], []
+            for habit_id, streaks in existing.items():
+                intervals, counts = merged_counts(streaks)
+                if counts[1] == counts[0]:
+                    continue
+                compacted[habit_id] = counts
+                update = updates[habit_id]
+                update.merged = True
+                update.stats = HabitStats.from_streaks(intervals)
+                if Habit.streak_storage == "embedded":
+                    update.set_intervals(intervals)
+                    continue
+                merged_streaks = {(start, end) for start, end in intervals}
+                deletes += [
+                    DeleteOne({"_id": streak_id, "start": start, "end": end})
+                    for (start, end), streak_id in streaks.items()
+                    if (start, end) not in merged_streaks
+                ]
+                inserts += [
+                    InsertOne(HabitStreak.new_raw(habit_id, habits[habit_id], start, end))
+                    for start, end in intervals
+                    if (start, end) not in streaks
+                ]
+            if deletes or inserts:
+                # Old streaks are deleted first because the new streaks may have the same start dates
+                Habit._write_streaks(next(iter(updates.values())).lock, deletes + inserts)
+        return compacted, busy
+
+    def delete(self, defer=None):
+        """Delete the habit and its streaks, and remove its completions from the user's daily rollups.
+
+        The streaks are deleted with a single `delete_many` and the rollups are updated with a single
+        bulk write, rather than through the cascading delete rules. The rollups are updated before the
+        habit is deleted, so they never count the completions of a habit that is no longer shown.
+
+        Args:
+            defer (callable, optional): Called with a function that deletes the habit's streaks, e.g.
+                                        to run it after the response is sent. Defaults to None, which
+                                        deletes them right away.
+        """
+        habit_id, user_id = self.id, self.user_id
+
+        def delete_data():
+            HabitStreak._get_collection().delete_many({"habit": habit_id})
+
+        if self.active:
+            DailyRollup.increment(user_id, {
+                start + timedelta(n): -1
+                for start, end in self.get_completion_bitmap().streaks()
+                for n in range((end - start).days + 1)
+            })
+        completion_cache.pop(habit_id)
+        Habit._get_collection().delete_one({"_id": habit_id})
+        User.increment_data_version(user_id)
+        if defer is None:
+            delete_data()
         else:
-            self.set_complete(my_date)
+            defer(delete_data)
+
+    def completion_rate(self, my_date=None):
+        """Fraction of days from the habit's creation until a date on which it was completed.
+
+        Args:
+            my_date (datetime.date, optional): Last day included. Defaults to date.today().
+
+        Returns:
+            float: Completion rate, or None if the habit's stats haven't been calculated.
+        """
+        if self.stats is None:
+            return None
+        my_date = my_date or date.today()
+        num_days = (my_date - self.date_created.date()).days + 1
+        return min(self.stats.total_completions / num_days, 1) if num_days > 0 else 0
 
     def get_longest_streaks(self, num=1):
         """Get the longest `num` streaks for the habit"""
+        if self.streak_storage == "embedded":
+            streaks = self._embedded_streaks()
+            streaks.sort(key=lambda streak: streak.streak_length, reverse=True)
+            return streaks[:num]
         return HabitStreak.objects(habit=self.id).order_by("-streak_length")[:num]
 
     def get_recent_streaks(self, num=1):
         """Get the most recent `num` streaks for the habit"""
+        if self.streak_storage == "embedded":
+            return self._embedded_streaks()[::-1][:num]
         return HabitStreak.objects(habit=self.id).order_by("-start")[:num]
 
+    def _embedded_streaks(self):
+        """Unsaved HabitStreaks for the habit's embedded streak intervals, ordered by start date"""
+        return [
+            HabitStreak(
+                start=start, end=end, streak_length=(end - start).days + 1, habit=self,
+                user=self.user_id
+            )
+            for start, end in self.streak_intervals
+        ]
+
+    def move_streaks(self, storage):
+        """Move the habit's streaks to a streak storage, clearing them from the other storage.
+
+        Args:
+            storage (str): "collection" or "embedded".
+
+        Returns:
+            int: Number of streaks that were moved.
+        """
+        with self._streak_lock() as update:
+            streaks = HabitStreak.objects(habit=self.id).only("start", "end").as_pymongo()
+            existing_streaks = {
+                (streak["start"].date(), streak["end"].date()): streak["_id"] for streak in streaks
+            }
+            intervals = self._merged_intervals(
+                sorted([[streak["start"], streak["end"]] for streak in streaks] + update.intervals)
+            )
+            merged_streaks = {(start.date(), end.date()) for start, end in intervals}
+            if storage == "embedded":
+                # The embedded intervals are replaced too, since they're merged with the HabitStreaks
+                existing_streaks.update(
+                    {(start.date(), end.date()): None for start, end in update.intervals}
+                )
+            self._replace_streaks(update, existing_streaks, merged_streaks, storage)
+            if storage == "collection":
+                update.set_intervals([])
+        if storage == "embedded":
+            # Deleted once the intervals are saved, which happens when the lock is released
+            HabitStreak.objects(habit=self.id).delete()
+        return len(intervals)
+
+    @staticmethod
+    def _merged_intervals(intervals):
+        """Merge sorted [start, end] intervals that overlap or touch"""
+        merged = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1] + timedelta(1):
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
     def __repr__(self):
         return f"Habit(name='{self.name}', user='{self.user.email}')"
 
@@ -221,6 +1249,17 @@ class HabitStreak(db.Document):
         ]
     }
 
+    @staticmethod
+    def new_raw(habit_id, user_id, start, end):
+        """Create the raw document of a new HabitStreak, bypassing `HabitStreak.clean`"""
+        return HabitStreak(
+            start=start,
+            end=end,
+            streak_length=(end - start).days + 1,
+            habit=habit_id,
+            user=user_id
+        ).to_mongo().to_dict()
+
     def clean(self):
         """Perform validation / data cleaning that is run when document is saved"""
         # Default user reference is set here because it depends on another class attribute
@@ -233,3 +1272,95 @@ class HabitStreak(db.Document):
         start_str = f"date({self.start.strftime('%Y,%-m,%-d')})"
         end_str = f"date({self.end.strftime('%Y,%-m,%-d')})"
         return f"HabitStreak(start={start_str}, end={end_str})"
+
+
+class DailyRollup(db.Document):
+    """Document that counts the active habits a user completed on a date
+
+    Counts are updated whenever a habit is set as complete or incomplete, habit completions are
+    imported, or a habit is deleted. This allows the history grid of all of a user's habits to be
+    read with a single range query rather than from the streaks of every habit. The number of active
+    habits on each date isn't stored because it changes every day, but it can be calculated from the
+    creation dates of the user's habits.
+    """
+
+    user = db.ReferenceField(User, required=True, reverse_delete_rule=db.CASCADE, unique_with="date")
+    date = db.DateTimeField(required=True)
+    num_complete = db.IntField(default=0)
+
+    @staticmethod
+    def increment(user_id, counts):
+        """Add to the number of completed habits on several dates with a single bulk write.
+
+        Args:
+            user_id (ObjectId): Id of the user whose rollups are updated.
+            counts (dict): Maps datetime.date objects to the number added to their count, which is
+                           negative for removed completions.
+        """
+        operations = [
+            UpdateOne(
+                {"user": user_id, "date": datetime.combine(my_date, datetime.min.time())},
+                {"$inc": {"num_complete": count}},
+                upsert=True
+            )
+            for my_date, count in counts.items()
+            if count != 0
+        ]
+        if operations:
+            DailyRollup._get_collection().bulk_write(operations, ordered=False)
+
+    @staticmethod
+    def get_num_complete(user_id, start_date, end_date):
+        """Get the number of habits a user completed on each date in a range, with a single query.
+
+        Args:
+            user_id (ObjectId): Id of the user.
+            start_date (datetime.date): Inclusive start date of range.
+            end_date (datetime.date): Inclusive end date of range.
+
+        Returns:
+            numpy.ndarray: Number of completed habits on each date.
+        """
+        start = datetime.combine(start_date, datetime.min.time())
+        end = datetime.combine(end_date, datetime.min.time())
+        num_complete = np.zeros((end - start).days + 1, dtype=np.int64)
+        rollups = DailyRollup.objects(user=user_id, date__gte=start, date__lte=end) \
+                             .only("date", "num_complete").as_pymongo()
+        for rollup in rollups:
+            num_complete[(rollup["date"] - start).days] = rollup.get("num_complete", 0)
+        return num_complete
+
+    @staticmethod
+    def rebuild(user_id, repair=False):
+        """Recalculate a user's rollups from the streaks of their active habits.
+
+        Args:
+            user_id (ObjectId): Id of the user.
+            repair (bool, optional): Whether to replace rollups that don't match the recalculated
+                                     counts. Defaults to False, which only checks them.
+
+        Returns:
+            dict: Maps each datetime.date whose stored count was wrong to (stored, recalculated) counts.
+        """
+        counts = {}
+        streaks = Habit.get_streaks(Habit.objects(user=user_id, active=True).scalar("id"))
+        for start, end in (streak for habit_streaks in streaks.values() for streak in habit_streaks):
+            for n in range((end - start).days + 1):
+                my_date = (start + timedelta(n)).date()
+                counts[my_date] = counts.get(my_date, 0) + 1
+
+        stored = {
+            rollup["date"].date(): rollup.get("num_complete", 0)
+            for rollup in DailyRollup.objects(user=user_id).only("date", "num_complete").as_pymongo()
+        }
+        drift = {
+            my_date: (stored.get(my_date, 0), counts.get(my_date, 0))
+            for my_date in set(stored) | set(counts)
+            if stored.get(my_date, 0) != counts.get(my_date, 0)
+        }
+        if repair and drift:
+            DailyRollup.increment(user_id, {
+                my_date: correct - wrong for my_date, (wrong, correct) in drift.items()
+            })
+            User.increment_data_version(user_id, years={my_date.year for my_date in drift})
+        return drift
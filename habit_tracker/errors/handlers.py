@@ -1,4 +1,5 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, jsonify, render_template, request
+from habit_tracker.documents import StreakConflict
 
 errors = Blueprint("errors", __name__)
 
@@ -16,3 +17,20 @@ def error_500(error):
     error_title = "This page isn't working (500)"
     error_text = "We're experiencing an error on our end. Please try again later."
     return render_template("error.html", error_title=error_title, error_text=error_text), 500
+
+
+@errors.app_errorhandler(503)
+def error_503(error):
+    error_title = "Service unavailable (503)"
+    error_text = "We're handling a lot of requests right now. Please try again shortly."
+    return render_template("error.html", error_title=error_title, error_text=error_text), 503
+
+
+@errors.app_errorhandler(StreakConflict)
+def error_streak_conflict(error):
+    error_title = "Habit changed (409)"
+    error_text = ("This habit was changed somewhere else at the same time. Please reload the page and "
+                  "try again.")
+    if request.path.startswith("/api/"):
+        return jsonify(error=error_text), 409
+    return render_template("error.html", error_title=error_title, error_text=error_text), 409
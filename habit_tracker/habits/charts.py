@@ -0,0 +1,90 @@
+from xml.sax.saxutils import escape
+
+# Colors used in the habit strength chart
+FILL_COLOR = "#2b8cbe"
+GRID_COLOR = "#c9c9c9"
+TEXT_COLOR = "#000000"
+
+# Space (in pt) between the edge of the image and the plotting area, leaving room for tick labels
+MARGIN_LEFT = 48
+MARGIN_RIGHT = 14
+MARGIN_TOP = 10
+MARGIN_BOTTOM = 28
+
+
+def habit_strength_svg(dates, values, width=720, height=360):
+    """Draw a habit strength time series as an SVG area chart.
+
+    Produces the same chart as the matplotlib figure in `habits.routes`: the area under the series
+    is filled, the y-axis runs from 0% to 100%, and gridlines are drawn at each tick. About ten date
+    ticks are labeled, counting back from the last date.
+
+    Args:
+        dates (list[datetime.date]): Consecutive dates of the time series.
+        values (iterable[float]): Habit strength on each date, between 0 and 1.
+        width (int, optional): Width of the image in pt. Defaults to 720.
+        height (int, optional): Height of the image in pt. Defaults to 360.
+
+    Returns:
+        str: SVG image of the chart.
+    """
+    values = list(values)
+    left, right = MARGIN_LEFT, width - MARGIN_RIGHT
+    top, bottom = MARGIN_TOP, height - MARGIN_BOTTOM
+
+    def x_pos(i):
+        return left + (right - left) * i / max(len(dates) - 1, 1)
+
+    def y_pos(value):
+        return bottom - (bottom - top) * value
+
+    parts = [
+        '<?xml version="1.0" encoding="utf-8" standalone="no"?>',
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}pt" height="{height}pt" '
+        f'viewBox="0 0 {width} {height}" version="1.1">',
+        f'<rect x="0" y="0" width="{width}" height="{height}" fill="#ffffff"/>',
+    ]
+
+    # Area under the time series
+    if values:
+        points = " ".join(f"{x_pos(i):.2f},{y_pos(value):.2f}" for i, value in enumerate(values))
+        parts.append(
+            f'<polygon points="{x_pos(0):.2f},{bottom} {points} {x_pos(len(values) - 1):.2f},{bottom}" '
+            f'fill="{FILL_COLOR}"/>'
+        )
+
+    # Horizontal gridlines and percent labels
+    for pct in range(0, 101, 20):
+        y = y_pos(pct / 100)
+        parts.append(
+            f'<line x1="{left}" y1="{y:.2f}" x2="{right}" y2="{y:.2f}" '
+            f'stroke="{GRID_COLOR}" stroke-width="0.8"/>'
+        )
+        parts.append(_text(left - 6, y + 3.5, f"{pct}%", anchor="end"))
+
+    # Vertical gridlines and date labels, counting back from the last date like the matplotlib chart
+    step = max(-(-len(dates) // 10), 1)
+    for i in range(len(dates) - 1, -1, -step):
+        x = x_pos(i)
+        parts.append(
+            f'<line x1="{x:.2f}" y1="{top}" x2="{x:.2f}" y2="{bottom}" '
+            f'stroke="{GRID_COLOR}" stroke-width="0.8"/>'
+        )
+        parts.append(_text(x, bottom + 16, dates[i].strftime("%b %-d"), anchor="middle"))
+
+    # Plot outline
+    parts.append(
+        f'<rect x="{left}" y="{top}" width="{right - left}" height="{bottom - top}" '
+        f'fill="none" stroke="{GRID_COLOR}" stroke-width="0.8"/>'
+    )
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def _text(x, y, label, anchor):
+    """SVG text element in the font used by matplotlib's default style"""
+    return (
+        f'<text x="{x:.2f}" y="{y:.2f}" text-anchor="{anchor}" fill="{TEXT_COLOR}" '
+        f'font-family="DejaVu Sans, Bitstream Vera Sans, sans-serif" font-size="10">'
+        f'{escape(label)}</text>'
+    )
@@ -0,0 +1,173 @@
+import click
+from flask.cli import AppGroup
+from habit_tracker.documents import DailyRollup, Habit, User
+from habit_tracker.habits.history import (export_history, import_completions, import_format,
+                                          read_completions)
+
+habits_cli = AppGroup("habits", help="Manage habit data.")
+
+
+def _get_user(email):
+    """Get the user with an email, failing the command if there isn't one"""
+    user = User.objects(email=email).first()
+    if user is None:
+        raise click.ClickException(f"There is no user with the email '{email}'.")
+    return user
+
+
+def _user_habits(email):
+    """Habits of the user with an email, or of every user if the email is None"""
+    return Habit.objects(user=_get_user(email).id) if email else Habit.objects
+
+
+@habits_cli.command("import")
+@click.argument("email")
+@click.argument("file", type=click.File("r"))
+@click.option("--format", "file_format", type=click.Choice(["csv", "jsonl"]),
+              help="Format of the file. Defaults to the format matching its extension.")
+@click.option("--no-create", is_flag=True,
+              help="Ignore completions of habits that the user doesn't have.")
+def import_history(email, file, file_format, no_create):
+    """Import habit completions for the user with EMAIL from a CSV or JSON Lines FILE.
+
+    Each row has a habit name and a date (YYYY-MM-DD) on which it was completed. Use - to read from
+    stdin.
+    """
+    user = _get_user(email)
+    file_format = file_format or import_format(file.name)
+    if file_format is None:
+        raise click.ClickException("Couldn't tell the format of the file from its name. Use --format.")
+
+    try:
+        completions = read_completions(file, file_format)
+        num_added = import_completions(user.id, completions, create_habits=not no_create)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    for name, num in num_added.items():
+        click.echo(f"{name}: {num} new completions")
+
+
+@habits_cli.command("export")
+@click.argument("email")
+@click.option("--format", "file_format", type=click.Choice(["csv", "jsonl"]), default="csv",
+              show_default=True, help="Format of the export.")
+@click.option("--daily", is_flag=True,
+              help="Write one row per completed date instead of one per streak.")
+@click.option("--output", "-o", type=click.File("w"), default="-",
+              help="File to write to. Defaults to stdout.")
+def export(email, file_format, daily, output):
+    """Export the habits and streaks of the user with EMAIL."""
+    user = _get_user(email)
+    for chunk in export_history(user.id, file_format, daily=daily):
+        output.write(chunk)
+
+
+@habits_cli.command("rollups")
+@click.option("--email", help="Only check the user with this email. Defaults to every user.")
+@click.option("--repair", is_flag=True, help="Correct the rollups that don't match the users' streaks.")
+def rollups(email, repair):
+    """Check the daily completion rollups of users against their streaks."""
+    users = [_get_user(email)] if email else User.objects.only("email").no_cache()
+    num_users = num_drifted = 0
+    for user in users:
+        num_users += 1
+        drift = DailyRollup.rebuild(user.id, repair=repair)
+        if drift:
+            num_drifted += 1
+            click.echo(f"{user.email}: {len(drift)} dates {'repaired' if repair else 'out of date'}")
+    click.echo(f"Checked {num_users} users, {num_drifted} with rollups that were out of date.")
+
+
+@habits_cli.command("stats")
+@click.option("--email",
+              help="Only recalculate the habits of the user with this email. Defaults to every user.")
+@click.option("--batch-size", default=500, show_default=True,
+              help="Number of habits recalculated per query.")
+def stats(email, batch_size):
+    """Recalculate the stats of habits from their streaks."""
+    habits = _user_habits(email)
+
+    batch = []
+    num_habits = num_saved = 0
+    fields = ["user", "version"] + (["streak_intervals"] if Habit.streak_storage == "embedded" else [])
+    for habit in habits.only(*fields).as_pymongo().batch_size(batch_size):
+        batch.append(habit)
+        if len(batch) == batch_size:
+            num_saved += Habit.recalculate_stats(batch)
+            num_habits += len(batch)
+            batch = []
+    num_saved += Habit.recalculate_stats(batch)
+    num_habits += len(batch)
+    click.echo(f"Recalculated the stats of {num_saved} of {num_habits} habits.")
+    if num_saved < num_habits:
+        click.echo(
+            "The rest changed while they were being recalculated, which already updated their stats."
+        )
+
+
+@habits_cli.command("migrate-streaks")
+@click.option("--to", "storage", type=click.Choice(["collection", "embedded"]), required=True,
+              help="Streak storage that the streaks are moved to.")
+@click.option("--email",
+              help="Only migrate the habits of the user with this email. Defaults to every user.")
+@click.option("--batch-size", default=500, show_default=True, help="Number of habits read per query.")
+def migrate_streaks(storage, email, batch_size):
+    """Move the streaks of habits between HabitStreak documents and intervals embedded in the habits.
+
+    Set STREAK_STORAGE to the new storage once every habit has been migrated.
+    """
+    habits = _user_habits(email)
+
+    num_habits = num_streaks = 0
+    for habit in habits.only("user", "slug").batch_size(batch_size):
+        num_streaks += habit.move_streaks(storage)
+        num_habits += 1
+    click.echo(f"Moved {num_streaks} streaks of {num_habits} habits to the {storage} storage.")
+
+
+@habits_cli.command("streaks")
+@click.option("--email",
+              help="Only check the habits of the user with this email. Defaults to every user.")
+@click.option("--repair", is_flag=True, help="Merge the streaks that overlap or touch.")
+@click.option("--batch-size", default=500, show_default=True,
+              help="Number of habits checked per query.")
+def streaks(email, repair, batch_size):
+    """Check habits for streaks that overlap or touch, which should have been merged into one streak.
+
+    Habits that are being changed by another process are checked again once every other habit has been.
+    """
+    habits = _user_habits(email)
+
+    batch = []
+    busy = []
+    fragmented = {}
+    num_habits = 0
+
+    def check(batch):
+        compacted, skipped = Habit.compact_streaks(batch, repair=repair)
+        fragmented.update(compacted)
+        return skipped
+
+    for habit in habits.only("user", "slug").as_pymongo().batch_size(batch_size):
+        batch.append(habit)
+        num_habits += 1
+        if len(batch) == batch_size:
+            busy += check(batch)
+            batch = []
+    busy += check(batch)
+    if busy:
+        busy = check(busy)
+
+    habit_names = {
+        habit["_id"]: (habit["user"], habit["slug"])
+        for habit in Habit.objects(id__in=list(fragmented)).only("user", "slug").as_pymongo()
+    }
+    user_ids = [user_id for user_id, _ in habit_names.values()]
+    emails = dict(User.objects(id__in=user_ids).scalar("id", "email"))
+    for habit_id, (num_before, num_after) in fragmented.items():
+        user_id, slug = habit_names.get(habit_id, (None, habit_id))
+        click.echo(f"{emails.get(user_id)} {slug}: {num_before} streaks "
+                   f"{'merged' if repair else 'can be merged'} into {num_after}")
+    click.echo(f"Checked {num_habits} habits, {len(fragmented)} with streaks that overlap or touch.")
+    if busy:
+        click.echo(f"{len(busy)} habits were being changed by another process and weren't repaired.")
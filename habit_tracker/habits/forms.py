@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileAllowed, FileRequired
 from flask_login import current_user
 from habit_tracker.documents import Habit
 from wtforms import SubmitField, StringField
@@ -32,3 +33,12 @@ class RenameHabitForm(FlaskForm):
             raise ValidationError("The new habit name must be different from the current name.")
         elif Habit.objects(user=current_user.id, name=name.data):
             raise ValidationError(f"You are already tracking another habit named '{name.data}'.")
+
+
+class ImportHistoryForm(FlaskForm):
+    file = FileField("Completion history (CSV or JSON Lines)", validators=[
+        FileRequired(),
+        FileAllowed(["csv", "jsonl", "ndjson"],
+                    message="The file must be a .csv, .jsonl, or .ndjson file.")
+    ])
+    submit_import = SubmitField("Import")
@@ -0,0 +1,189 @@
+import csv
+import io
+import json
+import os
+from datetime import date, datetime, timedelta
+from habit_tracker.cache import CompletionBitmap
+from habit_tracker.documents import Habit, HabitStreak
+
+# File formats that habit completions can be imported from, by file extension
+IMPORT_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+# File formats that habit history can be exported to, with their mimetypes
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+# Completions are collected in bitmaps that start on this date, so any past date can be imported
+IMPORT_FIRST_DAY = date(1970, 1, 1)
+
+
+def import_format(filename):
+    """Return the import format of a file based on its extension, or None if it isn't supported"""
+    return IMPORT_FORMATS.get(os.path.splitext(filename)[1].lower())
+
+
+def read_completions(lines, file_format):
+    """Read habit completions from a CSV or JSON Lines file, one row at a time.
+
+    CSV files must have a header with "habit" and "date" columns. Each line of a JSON Lines file must
+    be an object with "habit" and "date" keys. Dates are formatted as YYYY-MM-DD.
+
+    Args:
+        lines (iterable[str]): Lines of the file, e.g. a file object opened in text mode.
+        file_format (str): Either "csv" or "jsonl".
+
+    Raises:
+        ValueError: If a row is missing a habit or date, or its date is invalid or in the future.
+
+    Yields:
+        tuple: (habit name, datetime.date) of each completion.
+    """
+    if file_format == "csv":
+        rows = enumerate(csv.DictReader(lines), start=2)
+    elif file_format == "jsonl":
+        rows = (
+            (line_num, json.loads(line)) for line_num, line in enumerate(lines, start=1) if line.strip()
+        )
+    else:
+        raise ValueError(f"The file format must be one of {sorted(set(IMPORT_FORMATS.values()))}.")
+
+    today = date.today()
+    for line_num, row in rows:
+        try:
+            name = row["habit"].strip()
+            my_date = date.fromisoformat(row["date"].strip())
+        except (KeyError, AttributeError, TypeError, ValueError):
+            raise ValueError(
+                f"Line {line_num} must have a habit name and a date formatted as YYYY-MM-DD."
+            )
+        if not 1 <= len(name) <= 30:
+            raise ValueError(
+                f"Line {line_num} must have a habit name between 1 and 30 characters long."
+            )
+        if my_date > today:
+            raise ValueError(f"Line {line_num} has a date in the future.")
+        yield name, my_date
+
+
+def import_completions(user_id, completions, create_habits=True):
+    """Set a user's habits as complete on many dates.
+
+    Completions are collected in one bitmap per habit, so memory use depends on the number of habits
+    and the range of dates rather than the number of completions. Each habit's streaks are then
+    updated with a single bulk write.
+
+    Args:
+        user_id (ObjectId): Id of the user that the habits belong to.
+        completions (iterable): (habit name, datetime.date) tuples, e.g. from `read_completions`.
+        create_habits (bool, optional): Whether to create habits that the user doesn't have yet.
+                                        Otherwise their completions are ignored. Defaults to True.
+
+    Returns:
+        dict: Maps the name of each habit that was imported to its number of newly completed dates.
+    """
+    completed_per_habit = {}
+    for name, my_date in completions:
+        if name not in completed_per_habit:
+            completed_per_habit[name] = CompletionBitmap(IMPORT_FIRST_DAY, 0)
+        completed_per_habit[name][my_date] = True
+
+    habits = {
+        habit.name: habit for habit in Habit.objects(user=user_id, name__in=list(completed_per_habit))
+    }
+    num_added = {}
+    for name, completed in completed_per_habit.items():
+        habit = habits.get(name)
+        if habit is None:
+            if not create_habits:
+                continue
+            first_completed = next(completed.streaks())[0]
+            date_created = datetime.combine(first_completed, datetime.min.time())
+            habit = Habit(name=name, user=user_id, date_created=date_created)
+            habit.save()
+        num_added[name] = habit.add_completions(completed)
+    return num_added
+
+
+def _export_rows(user_id, daily, batch_size):
+    """Yield dictionaries describing a user's habits and streaks, reading streaks in batches"""
+    fields = ["name", "slug", "active", "date_created"]
+    if Habit.streak_storage == "embedded":
+        fields.append("streak_intervals")
+    habits = {
+        habit["_id"]: habit
+        for habit in Habit.objects(user=user_id).order_by("date_created").only(*fields).as_pymongo()
+    }
+    if Habit.streak_storage == "embedded":
+        streaks = (
+            {"habit": habit_id, "start": start, "end": end, "streak_length": (end - start).days + 1}
+            for habit_id, habit in habits.items()
+            for start, end in habit.get("streak_intervals", [])
+        )
+    else:
+        streaks = HabitStreak.objects(habit__in=list(habits)).order_by("habit", "start") \
+                             .only("habit", "start", "end", "streak_length").as_pymongo() \
+                             .batch_size(batch_size)
+
+    if not daily:
+        for habit in habits.values():
+            yield {
+                "type": "habit",
+                "habit": habit["name"],
+                "slug": habit["slug"],
+                "date_created": habit["date_created"].date().isoformat(),
+                "active": habit.get("active", True)
+            }
+    for streak in streaks:
+        name = habits[streak["habit"]]["name"]
+        if daily:
+            for n in range((streak["end"] - streak["start"]).days + 1):
+                yield {"habit": name, "date": (streak["start"] + timedelta(n)).date().isoformat()}
+        else:
+            yield {
+                "type": "streak",
+                "habit": name,
+                "start": streak["start"].date().isoformat(),
+                "end": streak["end"].date().isoformat(),
+                "streak_length": streak["streak_length"]
+            }
+
+
+def export_history(user_id, file_format, daily=False, batch_size=1000):
+    """Export a user's habits and streaks as CSV or JSON Lines, a chunk of text at a time.
+
+    Streaks are read from the database in batches, so the whole history is never held in memory.
+    By default the export has one row per habit followed by one row per streak. With `daily`, it has
+    one row per completed date instead, in the same format that `read_completions` imports.
+
+    Args:
+        user_id (ObjectId): Id of the user whose history is exported.
+        file_format (str): Either "csv" or "jsonl".
+        daily (bool, optional): Whether to expand streaks into one row per date. Defaults to False.
+        batch_size (int, optional): Number of streaks read per batch and rows per chunk. Defaults to
+                                    1000.
+
+    Yields:
+        str: Consecutive chunks of the exported file.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"The file format must be one of {list(EXPORT_FORMATS)}.")
+    if daily:
+        fields = ["habit", "date"]
+    else:
+        fields = ["type", "habit", "slug", "date_created", "active", "start", "end", "streak_length"]
+
+    buffer = io.StringIO()
+    if file_format == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator="\n")
+        writer.writeheader()
+        write_row = writer.writerow
+    else:
+        def write_row(row):
+            buffer.write(json.dumps(row) + "\n")
+
+    for num, row in enumerate(_export_rows(user_id, daily, batch_size), start=1):
+        write_row(row)
+        if num % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
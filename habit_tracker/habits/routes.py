@@ -1,15 +1,20 @@
-from flask import Blueprint, render_template, flash, redirect, url_for, request, abort, Response
+from flask import (Blueprint, render_template, flash, redirect, url_for, request, abort, Response,
+                   current_app, jsonify, get_template_attribute)
 from flask_login import current_user, login_required
+from habit_tracker import fragment_cache, view_fetcher
+from habit_tracker.cache import chart_cache
+from habit_tracker.concurrency import call_after_response
 from habit_tracker.documents import Habit
-from habit_tracker.habits.forms import AddHabitForm, RenameHabitForm
-from datetime import date
+from habit_tracker.habits.forms import AddHabitForm, RenameHabitForm, ImportHistoryForm
+from habit_tracker.habits.history import import_completions, import_format, read_completions
+from datetime import date, timedelta
 from dateutil.parser import parse
-from habit_tracker.habits.utils import create_habit_history_grid, create_habit_checklist, habit_strength
-from matplotlib.backends.backend_svg import FigureCanvasSVG
-from matplotlib.figure import Figure
-from matplotlib.ticker import PercentFormatter
-from matplotlib.dates import DateFormatter
+from habit_tracker.habits.charts import habit_strength_svg
+from habit_tracker.habits.utils import (create_habit_history_grid, create_habit_checklist,
+                                        habit_strengths, checklist_statuses, create_year_history_grid,
+                                        history_grid_squares, history_grid_years)
 from io import BytesIO
+import codecs
 
 
 habits = Blueprint("habits", __name__)
@@ -17,26 +22,56 @@ habits = Blueprint("habits", __name__)
 # Set break points that determine segmentation of completion rates used to color the habit history grid
 HISTORY_GRID_BREAKS = [0, 0.25, 0.5, 0.75, 1]
 
+# Max number of days in a checklist and updates in a single request to the checklist API
+API_MAX_CHECKLIST_DAYS = 366
+API_MAX_UPDATES = 100
+
 
 @habits.route("/my_habits/", methods=["GET", "POST"])
 @login_required
 def my_habits():
-    habit_list = Habit.objects(user=current_user.id, active=True).order_by("date_created")
+    habit_query = Habit.objects(user=current_user.id, active=True).order_by("date_created")
     num_days_in_checklist = 7
+    year = request.args.get("year", type=int)
 
     new_habit_form = AddHabitForm()
     if new_habit_form.validate_on_submit():
         Habit(name=new_habit_form.name.data, user=current_user.id).save()
         return redirect(url_for("habits.my_habits"))
 
-    checklist = create_habit_checklist(habits=habit_list, num_days=num_days_in_checklist)
-    history_grid = create_habit_history_grid(habits=habit_list, break_points=HISTORY_GRID_BREAKS)
+    # Both queries are made at the same time, although the habits aren't needed if nothing changed
+    user_id = current_user.id
+    grid_user_id = _grid_user_id()
+    endpoint = request.endpoint
+    fetched = view_fetcher.run(
+        versions=current_user.get_versions,
+        habits=lambda: list(habit_query)
+    )
+    versions = fetched["versions"]
+    habit_list = fetched["habits"]
+    if year is not None and year not in history_grid_years(habit_list):
+        return abort(404)
+    # Grids of past years are only rendered again when the completions in that year change
+    grid_version = versions["data_version"] if year is None else \
+        f"{versions['grid_version']}-{versions['grid_year_versions'].get(str(year), 0)}"
+
+    # The checklist and grid are only rendered again if the user's data changed or the day rolled over
+    rendered = view_fetcher.run(
+        checklist=lambda: fragment_cache.get_or_render(
+            "checklist", user_id, versions["data_version"],
+            lambda: get_template_attribute("macros.html", "render_checklist")(
+                habit_list, create_habit_checklist(habits=habit_list, num_days=num_days_in_checklist)
+            )
+        ),
+        history_grid=lambda: _history_grid_fragment(
+            "history_grid", user_id, grid_version, habit_list, year, endpoint, grid_user_id=grid_user_id
+        )
+    )
     return render_template(
         "my_habits.html",
         new_habit_form=new_habit_form,
-        habits=habit_list,
-        checklist=checklist,
-        history_grid=history_grid,
+        checklist_html=rendered["checklist"],
+        history_grid_html=rendered["history_grid"],
         title="My Habits"
     )
 
@@ -45,8 +80,19 @@ def my_habits():
 @login_required
 def habit(slug):
     habit = Habit.objects(user=current_user.id, slug=slug).get_or_404()
-    longest_streaks = habit.get_longest_streaks(num=5)
-    history_grid = create_habit_history_grid(habits=[habit], break_points=HISTORY_GRID_BREAKS)
+    year = request.args.get("year", type=int)
+    if year is not None and year not in history_grid_years([habit]):
+        return abort(404)
+    # The grid's links include the slug, which changes when the habit is renamed
+    grid_version = f"{habit.version}-{habit.slug}" if year is None else \
+        f"{habit.year_versions.get(str(year), 0)}-{habit.date_created.date()}-{habit.slug}"
+    endpoint = request.endpoint
+    fetched = view_fetcher.run(
+        longest_streaks=lambda: list(habit.get_longest_streaks(num=5)),
+        history_grid=lambda: _history_grid_fragment(
+            "habit_history_grid", habit.id, grid_version, [habit], year, endpoint, slug=habit.slug
+        )
+    )
 
     rename_habit_form = RenameHabitForm()
     rename_habit_form.current_name.data = habit.name
@@ -63,8 +109,8 @@ def habit(slug):
         "habit.html",
         habit=habit,
         title=habit.name,
-        history_grid=history_grid,
-        longest_streaks=longest_streaks,
+        history_grid_html=fetched["history_grid"],
+        longest_streaks=fetched["longest_streaks"],
         rename_habit_form=rename_habit_form
     )
 
@@ -85,20 +131,214 @@ def update_habit(slug):
     return redirect(url_for("habits.my_habits"))
 
 
+def _history_grid_fragment(name, owner_id, version, habit_list, year, endpoint, grid_user_id=None,
+                           **url_values):
+    """Render the history grid of the last year, or of a calendar year, through the fragment cache.
+
+    The grid of a past year is cached until its version changes rather than for a day, since it
+    only changes when completions in that year are changed.
+
+    Args:
+        name (str): Name of the fragment.
+        owner_id (ObjectId): Id of the user or habit whose grid is rendered.
+        version (int or str): Version of the data shown in the grid.
+        habit_list (list): Habit document objects used in the grid.
+        year (int): Year shown in the grid, or None for the 53 weeks ending today.
+        endpoint (str): Endpoint of the current page, which is read in the view since this runs in a
+                        ViewFetcher task.
+        grid_user_id (ObjectId, optional): Passed to the history grid functions. Defaults to None.
+        **url_values: Values of the current page's URL, used to link to the grid of each year.
+
+    Returns:
+        markupsafe.Markup: The rendered grid.
+    """
+    today = date.today()
+    years = history_grid_years(habit_list)
+    year_links = [("Last Year", url_for(endpoint, **url_values), year is None)] + [
+        (str(link_year), url_for(endpoint, year=link_year, **url_values), link_year == year)
+        for link_year in reversed(years)
+    ] if len(years) > 1 or year is not None else None
+    render_grid = get_template_attribute("macros.html", "render_history_grid")
+
+    if year is None:
+        return fragment_cache.get_or_render(name, owner_id, version, lambda: render_grid(
+            create_habit_history_grid(habits=habit_list, break_points=HISTORY_GRID_BREAKS,
+                                      user_id=grid_user_id),
+            year_links
+        ))
+    # Links to a new year are added when it starts
+    year_version = f"{year}-{today.year}-{version}"
+    return fragment_cache.get_or_render(f"{name}_year", owner_id, year_version, lambda: render_grid(
+        create_year_history_grid(habit_list, HISTORY_GRID_BREAKS, year, user_id=grid_user_id),
+        year_links
+    ), daily=year == today.year)
+
+
+def _grid_user_id():
+    """User id passed to the history grid functions, so they read the user's rollups if enabled"""
+    return current_user.id if current_app.config["HISTORY_GRID_FROM_ROLLUPS"] else None
+
+
+def _grid_square_json(square):
+    return {
+        "date": square.date.isoformat(),
+        "num_complete": square.num_complete,
+        "num_active": square.num_active,
+        "level": square.level
+    }
+
+
+@habits.route("/api/checklist", methods=["GET"])
+@login_required
+def api_checklist():
+    num_days = request.args.get("days", 7, type=int)
+    if not 1 <= num_days <= API_MAX_CHECKLIST_DAYS:
+        return jsonify(error=f"days must be between 1 and {API_MAX_CHECKLIST_DAYS}."), 400
+    habit_list = Habit.objects(user=current_user.id, active=True).order_by("date_created")
+    end_date = date.today()
+    start_date = end_date - timedelta(num_days - 1)
+    statuses = checklist_statuses(habit_list, start_date, end_date)
+    return jsonify(
+        dates=[(start_date + timedelta(n)).isoformat() for n in range(num_days)],
+        habits=[
+            {"slug": habit.slug, "name": habit.name, "statuses": statuses[habit.id]}
+            for habit in habit_list
+        ]
+    )
+
+
+@habits.route("/api/history_grid", methods=["GET"])
+@login_required
+def api_history_grid():
+    habit_list = Habit.objects(user=current_user.id, active=True).order_by("date_created")
+    year = request.args.get("year", type=int)
+    if year is None:
+        grid = create_habit_history_grid(habits=habit_list, break_points=HISTORY_GRID_BREAKS,
+                                         user_id=_grid_user_id())
+    elif year in history_grid_years(habit_list):
+        grid = create_year_history_grid(habit_list, HISTORY_GRID_BREAKS, year, user_id=_grid_user_id())
+    else:
+        return jsonify(error="There is no history for that year."), 404
+    return jsonify(
+        month_labels=grid.month_labels,
+        padding=grid.padding,
+        squares=[_grid_square_json(square) for square in grid.squares]
+    )
+
+
+@habits.route("/api/checklist", methods=["POST"])
+@login_required
+def api_update_checklist():
+    """Set habits as complete or incomplete on several dates.
+
+    The request body is {"updates": [{"slug": ..., "date": "YYYY-MM-DD", "complete": true}, ...]}.
+    Each habit's updates are written together, and only the checklist cells and history grid
+    squares that changed are returned.
+    """
+    updates = (request.get_json(silent=True) or {}).get("updates")
+    if not isinstance(updates, list) or not 1 <= len(updates) <= API_MAX_UPDATES:
+        return jsonify(error=f"updates must be a list of 1 to {API_MAX_UPDATES} updates."), 400
+
+    statuses_per_habit = {}
+    for update in updates:
+        try:
+            slug = update["slug"]
+            my_date = date.fromisoformat(update["date"])
+            complete = update["complete"]
+        except (KeyError, TypeError, ValueError):
+            return jsonify(error="Each update must have a slug, a date formatted as YYYY-MM-DD, "
+                                 "and whether it is complete."), 400
+        if not isinstance(complete, bool) or not isinstance(slug, str):
+            return jsonify(error="Each update must have a string slug and a boolean complete."), 400
+        statuses_per_habit.setdefault(slug, {})[my_date] = complete
+
+    habit_list = Habit.objects(user=current_user.id, active=True).order_by("date_created")
+    habits_by_slug = {habit.slug: habit for habit in habit_list}
+    missing = sorted(set(statuses_per_habit) - set(habits_by_slug))
+    if missing:
+        return jsonify(error=f"Unknown habits: {', '.join(missing)}."), 404
+
+    cells = []
+    changed_dates = set()
+    for slug, statuses in statuses_per_habit.items():
+        changes = habits_by_slug[slug].set_completions(statuses)
+        for my_date, complete in sorted(changes.items()):
+            status = "COMPLETE" if complete else "INCOMPLETE"
+            cells.append({"slug": slug, "date": my_date.isoformat(), "status": status})
+        changed_dates.update(changes)
+
+    squares = history_grid_squares(habit_list, HISTORY_GRID_BREAKS, changed_dates,
+                                   user_id=_grid_user_id())
+    return jsonify(cells=cells, squares=[_grid_square_json(square) for square in squares])
+
+
 @habits.route("/habit/<string:slug>/delete", methods=["POST"])
 @login_required
 def delete_habit(slug):
     habit = Habit.objects(user=current_user.id, slug=slug).get_or_404()
     name = habit.name
-    habit.delete()
+    habit.delete(defer=call_after_response if current_app.config["ASYNC_DELETION"] else None)
     flash(f"'{name}' has been deleted!", category="success")
     return redirect(url_for("habits.my_habits"))
 
 
+@habits.route("/my_habits/import", methods=["POST"])
+@login_required
+def import_history():
+    form = ImportHistoryForm()
+    if form.validate_on_submit():
+        upload = form.file.data
+        # Decode the uploaded file one line at a time rather than reading all of it into memory
+        lines = codecs.iterdecode(upload.stream, "utf-8")
+        try:
+            completions = read_completions(lines, import_format(upload.filename))
+            num_added = import_completions(current_user.id, completions)
+        except (ValueError, UnicodeDecodeError) as error:
+            flash(f"Your history couldn't be imported. {error}", category="danger")
+        else:
+            flash(f"Imported {sum(num_added.values())} completions of {len(num_added)} habits!",
+                  category="success")
+    else:
+        for error in form.file.errors:
+            flash(error, category="danger")
+    return redirect(url_for("users.account"))
+
+
 @habits.route("/habit/<string:slug>/strength")
 def plot_habit_strength(slug):
     habit = Habit.objects(user=current_user.id, slug=slug).get_or_404()
 
+    # The chart only changes when the habit's streaks change or the day rolls over
+    renderer = current_app.config["HABIT_STRENGTH_RENDERER"]
+    today = date.today()
+    etag = f"{habit.id}-{habit.version}-{today.strftime('%Y%m%d')}-{renderer}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        chart_key = (habit.id, habit.version, today, renderer)
+        svg = chart_cache.get(chart_key)
+        if svg is None:
+            svg = _render_habit_strength(habit, renderer)
+            chart_cache.set(chart_key, svg)
+        response = Response(svg, mimetype="image/svg+xml")
+
+    # Browsers may store the chart, but must check that it's still valid before reusing it
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _render_habit_strength(habit, renderer):
+    """Plot a habit's strength over time.
+
+    Args:
+        habit (Habit): Habit document object that is plotted.
+        renderer (str): "native" to draw the SVG directly, or "matplotlib" to draw it with matplotlib.
+
+    Returns:
+        str | bytes: SVG image of the plot.
+    """
     # Determine number of points to be plotted
     max_points = 100
     min_points = 7
@@ -109,13 +349,23 @@ def plot_habit_strength(slug):
     window_size = 30
 
     # Generate time series and plot
-    habit_strength_ts = habit_strength(habit, num_points, window_size)
+    strengths = habit_strengths([habit], num_points, [window_size])
+    dates, values = strengths.dates, strengths.values[0]
+    if renderer == "native":
+        return habit_strength_svg(dates, values)
+
+    # matplotlib is slow to import and uses a lot of memory, so it's only imported when needed
+    from matplotlib.backends.backend_svg import FigureCanvasSVG
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import PercentFormatter
+    from matplotlib.dates import DateFormatter
+
     fig = Figure(figsize=(10, 5))
     axis = fig.add_subplot(1, 1, 1, ylim=(0, 1))
     axis.fill_between(
-        x=habit_strength_ts.index,
+        x=dates,
         y1=0,
-        y2=habit_strength_ts.values,
+        y2=values,
         color="#2b8cbe"
     )
 
@@ -127,7 +377,7 @@ def plot_habit_strength(slug):
     axis.yaxis.set_ticks_position("none")
     axis.grid(color="#c9c9c9", axis="y")
     axis.grid(color="#c9c9c9", axis="x")
-    axis.xaxis.set_ticks(habit_strength_ts.index[::-len(habit_strength_ts.index) // 10])
+    axis.xaxis.set_ticks(dates[::-len(dates) // 10])
     axis.margins(x=0)
 
     # Format spines (plot outline)
@@ -139,4 +389,4 @@ def plot_habit_strength(slug):
 
     output = BytesIO()
     FigureCanvasSVG(fig).print_svg(output)
-    return Response(output.getvalue(), mimetype="image/svg+xml")
+    return output.getvalue()
@@ -1,10 +1,9 @@
-from bisect import bisect
 from calendar import month_abbr
 from collections import namedtuple
 from datetime import date, timedelta
 from flask import url_for
-from habit_tracker.documents import HabitStatus
-from pandas import Series
+from habit_tracker.documents import DailyRollup, Habit, HabitStatus
+import numpy as np
 
 
 def date_range(start_date, end_date, step=1, reverse=False):
@@ -22,6 +21,51 @@ def date_range(start_date, end_date, step=1, reverse=False):
         yield start_date + timedelta(n) if not reverse else end_date - timedelta(n)
 
 
+def _completion_status(habit, my_date, bitmap):
+    """Return the completion status of a habit on a date using its completion bitmap, already loaded.
+
+    Equivalent to `Habit.get_completion_status` without looking up the habit's bitmap.
+
+    Args:
+        habit (Habit): Habit document object.
+        my_date (datetime.date): Date for which we are checking a habit's status.
+        bitmap (CompletionBitmap): The habit's completion bitmap.
+
+    Returns:
+        HabitStatus: Enum representing habit completion status.
+    """
+    if not habit.is_active_date(my_date):
+        return HabitStatus.INACTIVE
+    return HabitStatus.COMPLETE if bitmap[my_date] else HabitStatus.INCOMPLETE
+
+
+def _completion_matrix(habits, start_date, end_date):
+    """Build a matrix of habit completion statuses for several habits over a range of dates.
+
+    Completion bitmaps that aren't cached are loaded with a single query. Each row of the matrix
+    corresponds to a habit and each column to a date, holding the value of the habit's HabitStatus
+    on that date.
+
+    Args:
+        habits (iterable): Habit document objects, one per row of the matrix.
+        start_date (datetime.date): Inclusive start date of range.
+        end_date (datetime.date): Inclusive end date of range.
+
+    Returns:
+        numpy.ndarray: int8 array of shape (number of habits, number of days).
+    """
+    num_days = (end_date - start_date).days + 1
+    matrix = np.full((len(habits), num_days), HabitStatus.INCOMPLETE.value, dtype=np.int8)
+    bitmaps = Habit.get_completion_bitmaps(habits)
+    for row, habit in enumerate(habits):
+        matrix[row, bitmaps[habit.id].range(start_date, end_date)] = HabitStatus.COMPLETE.value
+        # Days before the habit was created are inactive
+        inactive_days = (habit.date_created.date() - start_date).days
+        if inactive_days > 0:
+            matrix[row, :inactive_days] = HabitStatus.INACTIVE.value
+    return matrix
+
+
 def _grid_start_date(end_date):
     """Calculates the first date shown in the habit history grid.
 
@@ -70,7 +114,7 @@ def _grid_month_labels(start_date, end_date):
     return labels
 
 
-def _grid_squares(habits, break_points, start_date, end_date):
+def _grid_squares(habits, break_points, start_date, end_date, user_id=None):
     """Calculate values needed to render squares in the habit history grid.
 
     Only meant for use in the `create_habit_history_grid` function.
@@ -80,56 +124,110 @@ def _grid_squares(habits, break_points, start_date, end_date):
         break_points (list[int]): Break points used to divide up habit completion rates into levels.
         start_date (datetime.date): Inclusive start date that is shown in the habit history grid.
         end_date (datetime.date): Inclusive end date that is shown in the habit history grid.
+        user_id (ObjectId, optional): If given, the number of completed habits on each date is read
+                                      from the user's daily rollups instead of the habits' streaks.
 
     Returns:
         list[GridSquare]: List of namedtuples that have values used in the habit history grid.
     """
-    GridSquare = namedtuple("GridSquare", ["num_complete", "num_active", "level", "date_label"])
+    GridSquare = namedtuple("GridSquare", ["num_complete", "num_active", "level", "date_label", "date"])
+
+    if user_id is not None:
+        num_complete = DailyRollup.get_num_complete(user_id, start_date, end_date)
+        # Habits are active from the day they were created
+        days_created = np.sort([(habit.date_created.date() - start_date).days for habit in habits])
+        num_active = np.searchsorted(days_created, np.arange(len(num_complete)), side="right")
+    else:
+        completion = _completion_matrix(habits, start_date, end_date)
+        num_complete = (completion == HabitStatus.COMPLETE.value).sum(axis=0)
+        num_active = num_complete + (completion == HabitStatus.INCOMPLETE.value).sum(axis=0)
+    ratio = np.divide(num_complete, num_active, out=np.zeros(len(num_active)), where=num_active > 0)
+    levels = np.digitize(ratio, break_points) - 1
 
     grid = []
-    curr_date = start_date
-
-    completion_per_habit = (
-        [habit.get_completion_status_range(start_date, end_date) for habit in habits]
-        if len(habits) > 0
-        else [[None] * ((end_date - start_date).days + 1)]
-    )
-
-    completion_per_day = zip(*completion_per_habit)
-
-    for one_day_completion in completion_per_day:
-        num_complete = one_day_completion.count(HabitStatus.COMPLETE)
-        num_incomplete = one_day_completion.count(HabitStatus.INCOMPLETE)
-        num_active = num_complete + num_incomplete
-        ratio = num_complete / num_active if num_active > 0 else 0
-        level = bisect(break_points, ratio) - 1
-        date_label = curr_date.strftime("%b %-d, %Y")
-        curr_date += timedelta(1)
+    for day, curr_date in enumerate(date_range(start_date, end_date)):
         grid.append(GridSquare(
-            num_complete=num_complete,
-            num_active=num_active,
-            level=level,
-            date_label=date_label)
+            num_complete=int(num_complete[day]),
+            num_active=int(num_active[day]),
+            level=int(levels[day]),
+            date_label=curr_date.strftime("%b %-d, %Y"),
+            date=curr_date)
         )
     return grid
 
 
-def create_habit_history_grid(habits, break_points, end_date=date.today()):
+def create_habit_history_grid(habits, break_points, end_date=date.today(), user_id=None):
     """Produce values and labels necessary to render a habit history grid for a user.
 
     Args:
         habits (iterable): Habit document objects used in the grid.
         break_points (list[int]): Break points used to divide up habit completion rates into levels.
         end_date (datetime.date): Inclusive end date that is shown in the habit history grid.
+        user_id (ObjectId, optional): Id of the user, if `habits` are all of the user's habits. The
+                                      grid is then read from the user's daily rollups with one query.
+                                      Defaults to None.
 
     Returns:
-        Grid: namedtuple that includes month labels and a list of GridSquare namedtuples.
+        Grid: namedtuple that includes month labels, a list of GridSquare namedtuples, and the number of
+              empty squares before the first one, which is 0.
     """
     start_date = _grid_start_date(end_date)
     month_labels = _grid_month_labels(start_date, end_date)
-    squares = _grid_squares(habits, break_points, start_date, end_date)
-    Grid = namedtuple("Grid", ["month_labels", "squares"])
-    return Grid(month_labels=month_labels, squares=squares)
+    squares = _grid_squares(habits, break_points, start_date, end_date, user_id=user_id)
+    Grid = namedtuple("Grid", ["month_labels", "squares", "padding"])
+    return Grid(month_labels=month_labels, squares=squares, padding=0)
+
+
+def create_year_history_grid(habits, break_points, year, user_id=None):
+    """Produce values and labels necessary to render the habit history grid of a calendar year.
+
+    Grids of past years don't change unless completions in the year change, so they can be cached.
+    The grid of the current year ends today.
+
+    Args:
+        habits (iterable): Habit document objects used in the grid.
+        break_points (list[int]): Break points used to divide up habit completion rates into levels.
+        year (int): Year shown in the grid.
+        user_id (ObjectId, optional): Passed to `create_habit_history_grid`. Defaults to None.
+
+    Returns:
+        Grid: namedtuple that includes month labels, a list of GridSquare namedtuples, and the number of
+              empty squares before January 1st, which start the grid on a Sunday.
+    """
+    start_date = date(year, 1, 1)
+    end_date = min(date(year, 12, 31), date.today())
+    # Days from the Sunday on or before January 1st
+    padding = (start_date.weekday() + 1) % 7
+    month_labels = _grid_month_labels(start_date - timedelta(padding), end_date)
+    squares = _grid_squares(habits, break_points, start_date, end_date, user_id=user_id)
+    Grid = namedtuple("Grid", ["month_labels", "squares", "padding"])
+    return Grid(month_labels=month_labels, squares=squares, padding=padding)
+
+
+def history_grid_years(habits):
+    """Years that can be shown in the habit history grid, from the year the first habit was created
+    until now"""
+    first_year = min((habit.date_created.year for habit in habits), default=date.today().year)
+    return list(range(first_year, date.today().year + 1))
+
+
+def history_grid_squares(habits, break_points, dates, user_id=None):
+    """Calculate the squares of the habit history grid for a few dates, e.g. after they were updated.
+
+    Args:
+        habits (iterable): Habit document objects used in the grid.
+        break_points (list[int]): Break points used to divide up habit completion rates into levels.
+        dates (iterable[datetime.date]): Dates of the squares.
+        user_id (ObjectId, optional): Passed to `create_habit_history_grid`. Defaults to None.
+
+    Returns:
+        list[GridSquare]: Squares of the dates, in date order.
+    """
+    dates = set(dates)
+    if not dates:
+        return []
+    squares = _grid_squares(habits, break_points, min(dates), max(dates), user_id=user_id)
+    return [square for square in squares if square.date in dates]
 
 
 def create_habit_checklist(habits, num_days, end_date=date.today()):
@@ -141,14 +239,17 @@ def create_habit_checklist(habits, num_days, end_date=date.today()):
         end_date (datetime.date, optional): Last day shown in the checklist. Defaults to date.today().
 
     Returns:
-        HabitChecklist: namedtuple with dictionaries of labels, values, and routes used in checklist.
+        HabitChecklist: namedtuple with dictionaries of labels, values, and routes used in checklist,
+                        and the ISO format date of each column.
     """
     start_date = end_date - timedelta(num_days - 1)
     date_labels = [date.strftime("%-m/%-d") for date in date_range(start_date, end_date, reverse=True)]
+    # Bitmaps for every habit are loaded at once rather than querying each habit on each date
+    bitmaps = Habit.get_completion_bitmaps(habits)
     completion_statuses = {
         habit.id: [
             # Jinja templates don't support Enum classes, so use the name instead
-            habit.get_completion_status(date).name
+            _completion_status(habit, date, bitmaps[habit.id]).name
             for date in date_range(start_date, end_date, reverse=True)
         ]
         for habit in habits
@@ -160,30 +261,85 @@ def create_habit_checklist(habits, num_days, end_date=date.today()):
         ]
         for habit in habits
     }
-    HabitChecklist = namedtuple("HabitChecklist", ["date_labels", "completion", "routes"])
-    return HabitChecklist(date_labels=date_labels, completion=completion_statuses, routes=routes)
+    dates = [date.isoformat() for date in date_range(start_date, end_date, reverse=True)]
+    HabitChecklist = namedtuple("HabitChecklist", ["date_labels", "completion", "routes", "dates"])
+    return HabitChecklist(
+        date_labels=date_labels, completion=completion_statuses, routes=routes, dates=dates
+    )
 
 
-def habit_strength(habit, num_points, window_size):
-    end_date = date.today()
-    start_date = end_date - timedelta(num_points + window_size - 2)
+def checklist_statuses(habits, start_date, end_date):
+    """Get the completion status of several habits on each date in a range.
+
+    Args:
+        habits (iterable): Habit document objects.
+        start_date (datetime.date): Inclusive start date of range.
+        end_date (datetime.date): Inclusive end date of range.
+
+    Returns:
+        dict: Maps each habit id to a list of HabitStatus names, one per date from start to end.
+    """
+    matrix = _completion_matrix(habits, start_date, end_date)
+    names = {status.value: status.name for status in HabitStatus}
+    return {habit.id: [names[value] for value in row.tolist()] for habit, row in zip(habits, matrix)}
+
+
+def habit_strengths(habits, num_points, window_sizes, end_date=None):
+    """Calculate habit strength time series for several habits and moving average window sizes at once.
+
+    Habit strength is the moving average of a habit's daily completion. Completion for every habit is
+    loaded into one matrix, and all of the moving averages are taken from its cumulative sums.
+
+    Args:
+        habits (iterable): Habit document objects.
+        num_points (int): Number of days in each time series.
+        window_sizes (list[int]): Number of days in each moving average, e.g. [7, 30, 90].
+        end_date (datetime.date, optional): Last day of the time series. Defaults to date.today().
+
+    Returns:
+        HabitStrengths: namedtuple with the list of dates in the time series, a list of
+                        (habit id, window size) tuples labeling each row, and a 2D numpy array of
+                        habit strengths with one row per (habit, window size) and one column per date.
+    """
+    end_date = end_date or date.today()
+    max_window_size = max(window_sizes)
+    start_date = end_date - timedelta(num_points + max_window_size - 2)
     series_start_date = end_date - timedelta(num_points - 1)
-    completion = habit.get_completion_status_range(start_date, end_date)
-    completion_bin = [1 if c == HabitStatus.COMPLETE else 0 for c in completion]
-    return Series(data=moving_avg(completion_bin, window_size),
-                  index=list(date_range(series_start_date, end_date)),
-                  name="Habit Strength")
 
+    complete = _completion_matrix(habits, start_date, end_date) == HabitStatus.COMPLETE.value
+    # Column i holds the number of completions in the first i days
+    cumulative = np.zeros((complete.shape[0], complete.shape[1] + 1))
+    np.cumsum(complete, axis=1, out=cumulative[:, 1:])
 
-def moving_avg(nums, window_size):
-    if not nums:
-        return []
-    moving_avg = []
-    current_sum = sum(nums[:window_size - 1])
-    left, right = -1, window_size - 1
-    while right < len(nums):
-        current_sum += nums[right] - (nums[left] if left >= 0 else 0)
-        moving_avg.append(current_sum / window_size)
-        left += 1
-        right += 1
-    return moving_avg
+    rows = []
+    strengths = np.empty((len(habits) * len(window_sizes), num_points))
+    for i, habit in enumerate(habits):
+        for j, window_size in enumerate(window_sizes):
+            # Completions in the window_size days ending at each date of the time series
+            window_ends = cumulative[i, max_window_size:]
+            first_start = max_window_size - window_size
+            window_starts = cumulative[i, first_start:first_start + num_points]
+            strengths[len(rows)] = (window_ends - window_starts) / window_size
+            rows.append((habit.id, window_size))
+
+    HabitStrengths = namedtuple("HabitStrengths", ["dates", "rows", "values"])
+    dates = list(date_range(series_start_date, end_date))
+    return HabitStrengths(dates=dates, rows=rows, values=strengths)
+
+
+def habit_strength(habit, num_points, window_size):
+    """Calculate a habit strength time series for a single habit.
+
+    Args:
+        habit (Habit): Habit document object.
+        num_points (int): Number of days in the time series.
+        window_size (int): Number of days in the moving average.
+
+    Returns:
+        pandas.Series: Habit strength indexed by date.
+    """
+    # pandas is slow to import and uses a lot of memory, so it's only imported when needed
+    from pandas import Series
+
+    strengths = habit_strengths([habit], num_points, [window_size])
+    return Series(data=strengths.values[0], index=strengths.dates, name="Habit Strength")
@@ -0,0 +1,167 @@
+import json
+import logging
+from collections import Counter
+from threading import Lock
+from time import perf_counter
+from flask import g, has_request_context, request
+from pymongo import monitoring
+
+# Commands that pymongo runs for its own bookkeeping rather than for the app
+IGNORED_COMMANDS = {"isMaster", "ismaster", "hello", "ping", "endSessions", "saslStart", "saslContinue",
+                    "getnonce", "authenticate", "buildinfo", "buildInfo"}
+
+# Keys that hold the filter document(s) of a command, for commands that have one
+FILTER_KEYS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "findandmodify": "query",
+}
+STATEMENT_KEYS = {"update": ("updates", "q"), "delete": ("deletes", "q")}
+
+
+def _shape(value):
+    """Replace the values in a query filter with their type names, keeping its structure"""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_shape(item) for item in value[:1]]
+    return type(value).__name__
+
+
+def query_shape(event):
+    """Describe a command with the values removed, so repeats of the same query can be detected.
+
+    Args:
+        event (pymongo.monitoring.CommandStartedEvent): Event published when the command started.
+
+    Returns:
+        str: Command name, collection name, and the shape of its filter.
+    """
+    command = event.command
+    collection = command.get(event.command_name)
+    if event.command_name in FILTER_KEYS:
+        query_filter = command.get(FILTER_KEYS[event.command_name], {})
+    elif event.command_name in STATEMENT_KEYS:
+        statements_key, filter_key = STATEMENT_KEYS[event.command_name]
+        query_filter = [statement.get(filter_key, {}) for statement in command.get(statements_key, [])]
+    elif event.command_name == "aggregate":
+        query_filter = command.get("pipeline", [])
+    else:
+        query_filter = None
+    shape = json.dumps(_shape(query_filter), sort_keys=True) if query_filter is not None else ""
+    return f"{event.command_name} {collection} {shape}".strip()
+
+
+class DatabaseInstrumentation(monitoring.CommandListener):
+    """Flask extension that counts and times the database commands run by each request.
+
+    Each response gets a Server-Timing header with the time spent in the database and in the whole
+    request, and a structured log line is written with the query counts of the view function. Queries
+    that have the same shape and are repeated more than DB_N_PLUS_ONE_THRESHOLD times in a single
+    request are flagged as likely N+1 query patterns.
+    """
+
+    def __init__(self):
+        self._registered = False
+        self.logger = logging.getLogger("habit_tracker.instrumentation")
+
+    def init_app(self, app):
+        """Instrument an app. Must be called before the app connects to the database."""
+        if not self._registered:
+            # pymongo only notifies listeners that were registered before a client is created
+            monitoring.register(self)
+            self._registered = True
+        if self.logger.level == logging.NOTSET:
+            self.logger.setLevel(logging.INFO)
+        threshold = app.config["DB_N_PLUS_ONE_THRESHOLD"]
+
+        @app.before_request
+        def start_db_stats():
+            g.db_stats = self.new_stats()
+
+        @app.after_request
+        def report_db_stats(response):
+            stats = g.pop("db_stats", None)
+            if stats is None:
+                return response
+            total_ms = (perf_counter() - stats["start"]) * 1000
+            db_ms = stats["duration"] * 1000
+            response.headers.add(
+                "Server-Timing",
+                f'db;dur={db_ms:.1f};desc="{stats["queries"]} queries", total;dur={total_ms:.1f}'
+            )
+            repeated = {shape: count for shape, count in stats["shapes"].items() if count > threshold}
+            log_entry = {
+                "endpoint": request.endpoint,
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "queries": stats["queries"],
+                "db_ms": round(db_ms, 1),
+                "total_ms": round(total_ms, 1),
+                "n_plus_one": repeated
+            }
+            if repeated:
+                self.logger.warning("Possible N+1 queries: %s", json.dumps(log_entry))
+            else:
+                self.logger.info("Database usage: %s", json.dumps(log_entry))
+            return response
+
+    @staticmethod
+    def new_stats():
+        """Empty stats for the commands run by a request.
+
+        Commands are reported on the thread that ran them, so the stats have a lock for requests that
+        run queries on several threads at once.
+        """
+        return {
+            "start": perf_counter(),
+            "queries": 0,
+            "duration": 0.0,
+            "shapes": Counter(),
+            "pending": {},
+            "lock": Lock()
+        }
+
+    @staticmethod
+    def merge_stats(stats, other):
+        """Add the commands counted in `other`, e.g. by a task on another thread, to `stats`"""
+        with stats["lock"]:
+            stats["queries"] += other["queries"]
+            stats["duration"] += other["duration"]
+            stats["shapes"].update(other["shapes"])
+
+    @staticmethod
+    def _request_stats():
+        """Stats of the current request, or None outside of an instrumented request"""
+        if not has_request_context():
+            return None
+        return g.get("db_stats")
+
+    def started(self, event):
+        stats = self._request_stats()
+        if stats is None or event.command_name in IGNORED_COMMANDS:
+            return
+        shape = query_shape(event)
+        with stats["lock"]:
+            stats["pending"][event.request_id] = shape
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        stats = self._request_stats()
+        if stats is None:
+            return
+        with stats["lock"]:
+            shape = stats["pending"].pop(event.request_id, None)
+            if shape is None:
+                return
+            stats["queries"] += 1
+            stats["duration"] += event.duration_micros / 1e6
+            stats["shapes"][shape] += 1
@@ -0,0 +1,60 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+# Streaks embedded in Habit documents are stored as lists of inclusive [start, end] intervals that are
+# sorted by start date and don't overlap or touch, so they can be searched with bisect.
+
+
+def find_interval(intervals, day):
+    """Find the interval that contains a day.
+
+    Args:
+        intervals (list): Sorted [start, end] intervals of datetime objects.
+        day (datetime): Day that is looked up.
+
+    Returns:
+        int: Index of the interval containing the day, or None if it isn't in any interval.
+    """
+    # Index of the last interval that starts on or before the day
+    index = bisect_right(intervals, [day, datetime.max]) - 1
+    if index >= 0 and intervals[index][1] >= day:
+        return index
+    return None
+
+
+def set_day(intervals, day, complete):
+    """Add a day to the intervals or remove it, merging or splitting the intervals next to it.
+
+    Args:
+        intervals (list): Sorted [start, end] intervals of datetime objects. They aren't modified.
+        day (datetime): Day that is added or removed.
+        complete (bool): Whether the day is added (True) or removed (False).
+
+    Returns:
+        list: New sorted intervals, or the same list if the day was already (in)complete.
+    """
+    index = bisect_right(intervals, [day, datetime.max]) - 1
+    contains_day = index >= 0 and intervals[index][1] >= day
+    if complete == contains_day:
+        return intervals
+
+    new_intervals = list(intervals)
+    if not complete:
+        start, end = intervals[index]
+        new_intervals[index:index + 1] = (
+            ([[start, day - timedelta(1)]] if start < day else [])
+            + ([[day + timedelta(1), end]] if day < end else [])
+        )
+        return new_intervals
+
+    joins_left = index >= 0 and intervals[index][1] == day - timedelta(1)
+    joins_right = index + 1 < len(intervals) and intervals[index + 1][0] == day + timedelta(1)
+    if joins_left and joins_right:
+        new_intervals[index:index + 2] = [[intervals[index][0], intervals[index + 1][1]]]
+    elif joins_left:
+        new_intervals[index] = [intervals[index][0], day]
+    elif joins_right:
+        new_intervals[index + 1] = [day, intervals[index + 1][1]]
+    else:
+        new_intervals.insert(index + 1, [day, day])
+    return new_intervals
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
 from flask_login import current_user
-from habit_tracker import bcrypt
+from habit_tracker import password_hasher
 from wtforms import StringField, PasswordField, SubmitField, BooleanField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError
 from habit_tracker.documents import User
@@ -48,9 +48,9 @@ class UpdatePasswordForm(FlaskForm):
     submit_password = SubmitField("Update Password")
 
     def validate_current_password(self, current_password):
-        if not bcrypt.check_password_hash(current_user.password, current_password.data):
+        if not password_hasher.check_password_hash(current_user.password, current_password.data):
             raise ValidationError("Current password is incorrect.")
 
     def validate_new_password(self, new_password):
-        if bcrypt.check_password_hash(current_user.password, new_password.data):
+        if password_hasher.check_password_hash(current_user.password, new_password.data):
             raise ValidationError("New password cannot be the same as your current password.")
@@ -1,10 +1,14 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import (Blueprint, render_template, redirect, url_for, flash, request, abort, Response,
+                   current_app, stream_with_context)
 from habit_tracker.users.forms import (RegistrationForm, LoginForm,
                                        UpdateEmailForm, UpdatePasswordForm)
 from flask_login import current_user, login_user, logout_user, login_required
-from habit_tracker import bcrypt
+from habit_tracker import password_hasher
+from habit_tracker.concurrency import call_after_response
 from habit_tracker.documents import User
-from habit_tracker.users.utils import is_safe_url
+from habit_tracker.habits.forms import ImportHistoryForm
+from habit_tracker.habits.history import EXPORT_FORMATS, export_history
+from habit_tracker.users.utils import is_safe_url, rehash_password
 
 
 users = Blueprint("users", __name__)
@@ -18,7 +22,7 @@ def register():
 
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_pass = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_pass = password_hasher.generate_password_hash(form.password.data)
         user = User(
             email=form.email.data,
             password=hashed_pass
@@ -38,8 +42,12 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.objects(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        if user and password_hasher.check_password_hash(user.password, form.password.data):
             login_user(user, remember=form.remember.data)
+            if password_hasher.needs_rehash(user.password):
+                # Hashes made with an old cost factor are upgraded once the response has been sent
+                password = form.password.data
+                call_after_response(lambda: rehash_password(user, password))
 
             next_page = request.args.get("next")
             if next_page and is_safe_url(next_page):
@@ -62,6 +70,7 @@ def logout():
 def account():
     email_form = UpdateEmailForm()
     password_form = UpdatePasswordForm()
+    import_form = ImportHistoryForm()
     anchor = ""
 
     # Check submit field's data because is_submitted() doesn't differentiate between forms
@@ -69,6 +78,7 @@ def account():
         if email_form.validate():
             current_user.email = email_form.email.data
             current_user.save()
+            current_user.uncache()
             flash("Your email has been updated!", category="success")
             return redirect(url_for("users.account"))
         else:
@@ -80,9 +90,10 @@ def account():
     # Check submit field's data because is_submitted() doesn't differentiate between forms
     if password_form.submit_password.data:
         if password_form.validate():
-            hashed_pass = bcrypt.generate_password_hash(password_form.new_password.data).decode('utf-8')
+            hashed_pass = password_hasher.generate_password_hash(password_form.new_password.data)
             current_user.password = hashed_pass
             current_user.save()
+            current_user.uncache()
             flash("Your password has been updated!", category="success")
             return redirect(url_for("users.account"))
         else:
@@ -93,12 +104,30 @@ def account():
                            title="Account",
                            email_form=email_form,
                            password_form=password_form,
+                           import_form=import_form,
                            anchor=anchor)
 
 
+@users.route("/account/export")
+@login_required
+def export_account():
+    file_format = request.args.get("format", "csv")
+    if file_format not in EXPORT_FORMATS:
+        return abort(400)
+    daily = request.args.get("daily") == "1"
+    filename = f"habit_history{'_daily' if daily else ''}.{file_format}"
+    # The export is streamed so that large histories never need to be held in memory
+    return Response(
+        stream_with_context(export_history(current_user.id, file_format, daily=daily)),
+        mimetype=EXPORT_FORMATS[file_format],
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
 @users.route("/delete_account", methods=["POST"])
 @login_required
 def delete_account():
-    current_user.delete()
+    current_user.delete(defer=call_after_response if current_app.config["ASYNC_DELETION"] else None)
+    logout_user()
     flash(f"Your account has been deleted!", category="success")
     return redirect(url_for("users.register"))
@@ -1,8 +1,25 @@
 from urllib.parse import urljoin, urlparse
 from flask import request
+from habit_tracker import password_hasher
+from habit_tracker.documents import User
 
 
 def is_safe_url(target):
     ref_url = urlparse(request.host_url)
     test_url = urlparse(urljoin(request.host_url, target))
     return test_url.scheme in ('http', 'https') and ref_url.netloc == test_url.netloc
+
+
+def rehash_password(user, password):
+    """Replace a user's password hash with one made with the configured cost factor.
+
+    The hash is only replaced if it hasn't changed since the user was read, so a password that was
+    changed in the meantime isn't overwritten.
+
+    Args:
+        user (User): User who just logged in with the password.
+        password (str): The user's password.
+    """
+    pw_hash = password_hasher.generate_password_hash(password)
+    if User.objects(id=user.id, password=user.password).update_one(set__password=pw_hash):
+        user.uncache()
@@ -0,0 +1,48 @@
+import os
+import pytest
+
+# `habit_tracker.config` reads the production settings from the environment when it's imported, so
+# placeholders are set for any that are missing
+for name in ("ATLAS_USER", "ATLAS_PASS", "SECRET_KEY"):
+    os.environ.setdefault(name, "test")
+
+from habit_tracker import create_app, fragment_cache  # noqa 402
+from habit_tracker.cache import chart_cache, completion_cache, user_cache  # noqa 402
+from habit_tracker.documents import DailyRollup, Habit, HabitStreak, User  # noqa 402
+
+PASSWORD = "password"
+
+
+@pytest.fixture(scope="session")
+def app():
+    """App using the test config, created once since it connects to the in-memory database"""
+    return create_app("test")
+
+
+@pytest.fixture(autouse=True)
+def clean_database(app):
+    """Empty the database and the caches after each test"""
+    yield
+    for document in (User, Habit, HabitStreak, DailyRollup):
+        document.drop_collection()
+    for cache in (completion_cache, chart_cache, user_cache):
+        cache.clear()
+    fragment_cache.clear()
+
+
+@pytest.fixture
+def user(app):
+    """Registered user"""
+    client = app.test_client()
+    client.post("/register", data={
+        "email": "user@example.com", "password": PASSWORD, "confirm_password": PASSWORD
+    })
+    return User.objects.get(email="user@example.com")
+
+
+@pytest.fixture
+def client(app, user):
+    """Test client logged in as `user`"""
+    client = app.test_client()
+    client.post("/login", data={"email": user.email, "password": PASSWORD})
+    return client
@@ -0,0 +1,243 @@
+from datetime import date, datetime, timedelta
+from io import BytesIO
+from xml.etree import ElementTree
+import pytest
+from habit_tracker import fragment_cache, view_fetcher
+from habit_tracker.cache import completion_cache
+from habit_tracker.documents import Habit, HabitStatus, HabitStreak
+from habit_tracker.habits.charts import habit_strength_svg
+from habit_tracker.habits.commands import habits_cli
+from habit_tracker.habits.routes import HISTORY_GRID_BREAKS
+from habit_tracker.habits.utils import (create_habit_checklist, create_habit_history_grid,
+                                        habit_strengths)
+
+TODAY = date.today()
+
+
+def days_ago(n):
+    return TODAY - timedelta(n)
+
+
+def created(n):
+    """Creation time of a habit created n days ago"""
+    return datetime.combine(days_ago(n), datetime.min.time())
+
+
+@pytest.fixture
+def habits(user):
+    """Read, created 10 days ago and completed today and 2 days ago, and Walk, created yesterday and
+    completed then"""
+    read = Habit(name="Read", user=user, date_created=created(10))
+    walk = Habit(name="Walk", user=user, date_created=created(1))
+    read.save()
+    walk.save()
+    read.set_complete(TODAY)
+    read.set_complete(days_ago(2))
+    walk.set_complete(days_ago(1))
+    return read, walk
+
+
+def test_add_habit(client, user):
+    response = client.post("/my_habits/", data={"name": "Read"})
+    assert response.status_code == 302
+    habit = Habit.objects.get(user=user.id)
+    assert habit.slug == "read-0"
+
+
+def test_add_habits_with_same_slug(client, user):
+    client.post("/my_habits/", data={"name": "Read"})
+    client.post("/my_habits/", data={"name": "read!"})
+    assert sorted(Habit.objects(user=user.id).scalar("slug")) == ["read-0", "read-1"]
+
+
+def test_import_creates_habit(client, user):
+    history = BytesIO(b"habit,date\nRead,2024-01-01\nRead,2024-01-02\n")
+    response = client.post(
+        "/my_habits/import", data={"file": (history, "history.csv")}, content_type="multipart/form-data"
+    )
+    assert response.status_code == 302
+    habit = Habit.objects.get(user=user.id)
+    assert habit.slug == "read-0"
+    assert habit.get_completion_status_range(date(2024, 1, 1), date(2024, 1, 3)) == [
+        HabitStatus.COMPLETE, HabitStatus.COMPLETE, HabitStatus.INCOMPLETE
+    ]
+    assert habit.stats.total_completions == 2
+
+
+@pytest.mark.parametrize("args", [
+    ["import", "nobody@example.com", "-"],
+    ["export", "nobody@example.com"],
+    ["rollups", "--email", "nobody@example.com"],
+    ["stats", "--email", "nobody@example.com"],
+    ["migrate-streaks", "--to", "embedded", "--email", "nobody@example.com"],
+    ["streaks", "--email", "nobody@example.com"],
+])
+def test_commands_reject_unknown_email(app, user, args):
+    result = app.test_cli_runner().invoke(habits_cli, args, input="")
+    assert result.exit_code == 1
+    assert "There is no user with the email 'nobody@example.com'." in result.output
+
+
+def test_checklist(app, habits):
+    read, walk = habits
+    with app.test_request_context():
+        checklist = create_habit_checklist([read, walk], num_days=3, end_date=TODAY)
+    assert checklist.dates == [TODAY.isoformat(), days_ago(1).isoformat(), days_ago(2).isoformat()]
+    assert checklist.completion[read.id] == ["COMPLETE", "INCOMPLETE", "COMPLETE"]
+    assert checklist.completion[walk.id] == ["INCOMPLETE", "COMPLETE", "INACTIVE"]
+    assert checklist.routes[walk.id][1] == f"/habit/walk-0/update?date={days_ago(1)}"
+
+
+def test_history_grid_counts_active_habits(habits):
+    squares = create_habit_history_grid(habits, HISTORY_GRID_BREAKS, end_date=TODAY).squares
+    counts = [(square.num_complete, square.num_active, square.level) for square in squares[-4:]]
+    # Read is the only habit active 2 days ago, and Walk was only active from yesterday
+    assert counts == [(0, 1, 0), (1, 1, 4), (1, 2, 2), (1, 2, 2)]
+    assert squares[-1].date == TODAY
+
+
+def test_strength_chart_conditional_requests(client, habits):
+    response = client.get("/habit/read-0/strength")
+    assert response.status_code == 200
+    assert response.mimetype == "image/svg+xml"
+    etag = response.headers["ETag"]
+    assert "no-cache" in response.headers["Cache-Control"]
+
+    response = client.get("/habit/read-0/strength", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    client.post(f"/habit/read-0/update?date={days_ago(1)}")
+    response = client.get("/habit/read-0/strength", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_native_strength_chart():
+    dates = [date(2024, 1, 1) + timedelta(n) for n in range(20)]
+    values = [n / 19 for n in range(20)]
+    svg = ElementTree.fromstring(habit_strength_svg(dates, values, width=400, height=200))
+    namespace = {"svg": "http://www.w3.org/2000/svg"}
+    points = svg.find("svg:polygon", namespace).get("points").split()
+    # The area is closed along the x-axis at both ends
+    assert len(points) == 22
+    assert points[0].split(",")[1] == points[-1].split(",")[1] == "172"
+    assert points[1] == "48.00,172.00" and points[-2] == "386.00,10.00"
+    labels = [text.text for text in svg.findall("svg:text", namespace)]
+    assert labels[:6] == ["0%", "20%", "40%", "60%", "80%", "100%"]
+    # Every other date is labeled, counting back from the last one
+    assert labels[6:8] == ["Jan 20", "Jan 18"] and len(labels) == 16
+
+
+def test_habit_strengths_are_moving_averages(habits):
+    strengths = habit_strengths(habits, num_points=5, window_sizes=[2, 4], end_date=TODAY)
+    assert strengths.dates == [days_ago(n) for n in range(4, -1, -1)]
+    assert strengths.rows == [(habit.id, size) for habit in habits for size in (2, 4)]
+    for (habit_id, window_size), values in zip(strengths.rows, strengths.values):
+        habit = next(habit for habit in habits if habit.id == habit_id)
+        expected = [
+            sum(habit.get_completion_status(day - timedelta(n)) == HabitStatus.COMPLETE
+                for n in range(window_size)) / window_size
+            for day in strengths.dates
+        ]
+        assert values.tolist() == expected
+    assert strengths.values[0].tolist() == [0, 0, 0.5, 0.5, 0.5]
+
+
+def test_habit_stats(app, habits):
+    read, walk = habits
+    read.reload()
+    assert (read.stats.total_completions, read.stats.best_streak) == (2, 1)
+    assert read.stats.current_streak(TODAY) == 1
+    assert read.stats.current_streak(TODAY + timedelta(2)) == 0
+    assert read.completion_rate(TODAY) == 2 / 11
+
+    # Stats that were lost or never calculated are rebuilt from the streaks
+    Habit.objects(id=read.id).update_one(unset__stats=True)
+    walk.set_complete(TODAY)
+    result = app.test_cli_runner().invoke(habits_cli, ["stats", "--email", "user@example.com"])
+    assert "Recalculated the stats of 2 of 2 habits." in result.output
+    read.reload()
+    walk.reload()
+    assert (read.stats.total_completions, read.stats.last_streak_start.date()) == (2, TODAY)
+    assert (walk.stats.best_streak, walk.stats.current_streak(TODAY)) == (2, 2)
+
+
+def test_checklist_api(client, habits):
+    response = client.get("/api/checklist?days=3")
+    assert response.get_json() == {
+        "dates": [days_ago(2).isoformat(), days_ago(1).isoformat(), TODAY.isoformat()],
+        "habits": [
+            {"slug": "read-0", "name": "Read", "statuses": ["COMPLETE", "INCOMPLETE", "COMPLETE"]},
+            {"slug": "walk-0", "name": "Walk", "statuses": ["INACTIVE", "COMPLETE", "INCOMPLETE"]}
+        ]
+    }
+
+    # Updates that don't change anything aren't returned
+    response = client.post("/api/checklist", json={"updates": [
+        {"slug": "read-0", "date": days_ago(1).isoformat(), "complete": True},
+        {"slug": "walk-0", "date": days_ago(1).isoformat(), "complete": False},
+        {"slug": "walk-0", "date": TODAY.isoformat(), "complete": False}
+    ]})
+    assert response.get_json() == {
+        "cells": [
+            {"slug": "read-0", "date": days_ago(1).isoformat(), "status": "COMPLETE"},
+            {"slug": "walk-0", "date": days_ago(1).isoformat(), "status": "INCOMPLETE"}
+        ],
+        "squares": [{"date": days_ago(1).isoformat(), "num_complete": 1, "num_active": 2, "level": 2}]
+    }
+    assert client.get("/api/checklist?days=3").get_json()["habits"][1]["statuses"] == [
+        "INACTIVE", "INCOMPLETE", "INCOMPLETE"
+    ]
+    assert client.get("/api/checklist?days=400").status_code == 400
+
+
+@pytest.mark.parametrize("body, status", [
+    ({}, 400),
+    ({"updates": [{"slug": "read-0", "date": "yesterday", "complete": True}]}, 400),
+    ({"updates": [{"slug": "read-0", "date": "2024-01-01", "complete": "yes"}]}, 400),
+    ({"updates": [{"slug": "run-0", "date": "2024-01-01", "complete": True}]}, 404),
+])
+def test_checklist_api_rejects_bad_updates(client, habits, body, status):
+    response = client.post("/api/checklist", json=body)
+    assert response.status_code == status
+    assert "error" in response.get_json()
+
+
+def test_fragments_are_rendered_again_after_a_toggle(client, habits):
+    assert client.get("/my_habits/").get_data(as_text=True).count("checked>") == 3
+    assert client.get("/my_habits/").get_data(as_text=True).count("checked>") == 3
+    stats = fragment_cache.stats()
+    assert (stats["hits"], stats["misses"]) == ({"checklist": 1, "history_grid": 1},
+                                                {"checklist": 1, "history_grid": 1})
+
+    client.post(f"/habit/walk-0/update?date={TODAY}")
+    assert client.get("/my_habits/").get_data(as_text=True).count("checked>") == 4
+    stats = fragment_cache.stats()
+    assert (stats["hits"], stats["misses"]) == ({"checklist": 1, "history_grid": 1},
+                                                {"checklist": 2, "history_grid": 2})
+
+
+@pytest.mark.parametrize("path", ["/my_habits/", "/habit/read-0"])
+def test_pages_fetch_data_concurrently(client, habits, monkeypatch, path):
+    assert view_fetcher.executor is not None
+    response = client.get(path)
+    assert response.status_code == 200
+    timings = [timing.split(";")[0] for timing in response.headers["Server-Timing"].split(", ")]
+    assert "history_grid" in timings
+
+    # Without a thread pool the tasks run in the request's thread, and the page is the same
+    fragment_cache.clear()
+    monkeypatch.setattr(view_fetcher, "executor", None)
+    assert client.get(path).get_data() == response.get_data()
+
+
+def test_delete_habit(client, habits):
+    read, walk = habits
+    read.get_completion_bitmap()
+    response = client.post("/habit/read-0/delete")
+    assert response.status_code == 302
+    assert Habit.objects(id=read.id).count() == 0
+    assert HabitStreak.objects(habit=read.id).count() == 0
+    assert read.id not in completion_cache
+    assert Habit.get_streaks([walk.id])[walk.id] == [(created(1), created(1))]
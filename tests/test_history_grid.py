@@ -0,0 +1,87 @@
+from datetime import date, datetime, timedelta
+from io import BytesIO
+from habit_tracker import fragment_cache
+from habit_tracker.documents import DailyRollup, Habit
+from habit_tracker.habits.commands import rollups as rollups_command
+from habit_tracker.habits.routes import HISTORY_GRID_BREAKS
+from habit_tracker.habits.utils import create_habit_history_grid
+
+
+def import_history(client, history):
+    # Redirects are followed so that the flashed message isn't shown on the pages that are compared
+    return client.post(
+        "/my_habits/import", data={"file": (BytesIO(history), "history.csv")},
+        content_type="multipart/form-data", follow_redirects=True
+    )
+
+
+def test_year_grids_are_cached(client, user):
+    year = date.today().year - 1
+    import_history(client, f"habit,date\nRead,{year}-06-01\n".encode())
+    page = client.get(f"/my_habits/?year={year}").data
+    assert client.get(f"/my_habits/?year={year}").data == page
+    assert fragment_cache.stats()["hits"]["history_grid_year"] == 1
+
+
+def test_year_grid_changes_with_completions_in_its_year(client, user):
+    year = date.today().year - 2
+    import_history(client, f"habit,date\nRead,{year}-06-01\n".encode())
+    page = client.get(f"/my_habits/?year={year}").data
+    next_year_page = client.get(f"/my_habits/?year={year + 1}").data
+
+    update = {"slug": "read-0", "date": f"{year}-06-02", "complete": True}
+    client.post("/api/checklist", json={"updates": [update]})
+    assert client.get(f"/my_habits/?year={year}").data != page
+    assert client.get(f"/my_habits/?year={year + 1}").data == next_year_page
+    assert fragment_cache.stats()["hits"]["history_grid_year"] == 1
+
+
+def test_year_links_include_imported_years(client, user):
+    year = date.today().year - 1
+    import_history(client, f"habit,date\nRead,{year}-06-01\n".encode())
+    assert f"year={year - 1}".encode() not in client.get(f"/my_habits/?year={year}").data
+
+    # Moves the habit's creation date back to the year before
+    import_history(client, f"habit,date\nRead,{year - 1}-06-01\n".encode())
+    assert Habit.objects.get(user=user.id).date_created == datetime(year - 1, 6, 1)
+    assert f"year={year - 1}".encode() in client.get(f"/my_habits/?year={year}").data
+
+
+def test_missing_year(client, user):
+    client.post("/my_habits/", data={"name": "Read"})
+    assert client.get(f"/my_habits/?year={date.today().year - 1}").status_code == 404
+    assert client.get("/habit/read-0?year=1999").status_code == 404
+
+
+def grid_squares(user, **kwargs):
+    habits = Habit.objects(user=user.id, active=True)
+    return create_habit_history_grid(habits, HISTORY_GRID_BREAKS, **kwargs).squares
+
+
+def test_rebuilt_rollups_match_grid(app, client, user):
+    today = date.today()
+    completed = {"Read": range(0, 20, 3), "Walk": range(10)}
+    history = "habit,date\n" + "".join(
+        f"{name},{today - timedelta(n)}\n" for name, days in completed.items() for n in days
+    )
+    import_history(client, history.encode())
+    # Completions of inactive habits aren't counted
+    inactive_habit = Habit.objects.get(user=user.id, name="Walk")
+    Habit.objects(id=inactive_habit.id).update_one(set__active=False)
+    DailyRollup.drop_collection()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(rollups_command, ["--repair"])
+    assert "user@example.com: 7 dates repaired" in result.output
+    assert grid_squares(user, user_id=user.id) == grid_squares(user)
+    result = runner.invoke(rollups_command, [])
+    assert "Checked 1 users, 0 with rollups that were out of date." in result.output
+
+
+def test_deleted_habit_is_removed_from_rollups(client, user):
+    today = date.today()
+    import_history(client, f"habit,date\nRead,{today}\nWalk,{today}\n".encode())
+    client.post("/habit/walk-0/delete")
+    assert Habit.objects(user=user.id).count() == 1
+    assert grid_squares(user, user_id=user.id) == grid_squares(user)
+    assert DailyRollup.rebuild(user.id) == {}
@@ -0,0 +1,56 @@
+import logging
+from types import SimpleNamespace
+from flask import Flask
+from habit_tracker.instrumentation import DatabaseInstrumentation, query_shape
+
+
+def command_event(request_id, command_name, command, duration_micros=2000):
+    """Stand-in for the pymongo events that a command publishes, which mongomock doesn't"""
+    return SimpleNamespace(request_id=request_id, command_name=command_name, command=command,
+                           duration_micros=duration_micros)
+
+
+def run_queries(instrumentation, habit_ids):
+    """Report a query for the user, then one query per habit, as an N+1 pattern would"""
+    commands = [("find", {"find": "user", "filter": {"_id": 1}})]
+    for habit_id in habit_ids:
+        commands.append(("find", {"find": "habit_streak", "filter": {"habit": habit_id}}))
+    commands.append(("hello", {"hello": 1}))
+    for request_id, (command_name, command) in enumerate(commands):
+        event = command_event(request_id, command_name, command)
+        instrumentation.started(event)
+        instrumentation.succeeded(event)
+
+
+def test_query_shape():
+    query_filter = {"user": 7, "slug": {"$in": ["a", "b"]}}
+    event = command_event(1, "find", {"find": "habit", "filter": query_filter})
+    assert query_shape(event) == 'find habit {"slug": {"$in": ["str"]}, "user": "int"}'
+    event = command_event(2, "update", {"update": "habit", "updates": [{"q": {"_id": 7}, "u": {}}]})
+    assert query_shape(event) == 'update habit [{"_id": "int"}]'
+    assert query_shape(command_event(3, "getMore", {"getMore": 5})) == "getMore 5"
+
+
+def test_server_timing_and_n_plus_one(caplog):
+    app = Flask(__name__)
+    app.config["DB_N_PLUS_ONE_THRESHOLD"] = 3
+    instrumentation = DatabaseInstrumentation()
+    instrumentation.init_app(app)
+
+    @app.route("/habits/<int:num_habits>")
+    def habits(num_habits):
+        run_queries(instrumentation, range(num_habits))
+        return ""
+
+    with caplog.at_level(logging.INFO, logger="habit_tracker.instrumentation"):
+        response = app.test_client().get("/habits/3")
+        db_timing, total_timing = response.headers["Server-Timing"].split(", ")
+        assert db_timing == 'db;dur=8.0;desc="4 queries"'
+        assert total_timing.startswith("total;dur=")
+        assert caplog.records[-1].levelno == logging.INFO
+
+        response = app.test_client().get("/habits/4")
+        assert 'desc="5 queries"' in response.headers["Server-Timing"]
+        record = caplog.records[-1]
+        assert record.levelno == logging.WARNING
+        assert '"n_plus_one": {"find habit_streak {\\"habit\\": \\"int\\"}": 4}' in record.getMessage()
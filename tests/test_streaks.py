@@ -0,0 +1,283 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from threading import RLock
+import mongomock
+import pytest
+from habit_tracker import documents
+from habit_tracker.cache import CompletionBitmap, completion_cache
+from habit_tracker.documents import DailyRollup, Habit, HabitStatus, HabitStreak, StreakConflict
+from habit_tracker.habits.commands import streaks as streaks_command
+
+START = date(2024, 1, 1)
+
+
+def day(n):
+    """Datetime of the nth day after START, as streaks are stored"""
+    return datetime.combine(START + timedelta(n), datetime.min.time())
+
+
+@pytest.fixture(params=["collection", "embedded"])
+def storage(request, monkeypatch):
+    """Run the test with each streak storage"""
+    monkeypatch.setattr(Habit, "streak_storage", request.param)
+    return request.param
+
+
+@pytest.fixture
+def habit(app, user, storage):
+    habit = Habit(name="Read", user=user, date_created=day(0))
+    habit.save()
+    return habit
+
+
+def add_streaks(habit, streaks):
+    """Write streaks without merging them, as a partly written change could leave them"""
+    if habit.streak_storage == "embedded":
+        Habit._get_collection().update_one(
+            {"_id": habit.id},
+            {"$push": {"streak_intervals": {"$each": [[start, end] for start, end in streaks]}}}
+        )
+    else:
+        HabitStreak._get_collection().insert_many(
+            [HabitStreak.new_raw(habit.id, habit.user_id, start, end) for start, end in streaks]
+        )
+
+
+def lock(habit, expiry):
+    """Take the streak lock of a habit as another process would"""
+    Habit.objects(id=habit.id).update_one(set__streak_lock=expiry)
+
+
+def rollups(user):
+    return {rollup.date.date(): rollup.num_complete for rollup in DailyRollup.objects(user=user.id)}
+
+
+def test_toggle_merges_streaks(habit, user):
+    for n in (0, 2, 1):
+        habit.toggle_complete(START + timedelta(n))
+    habit.reload()
+    assert Habit.get_streaks([habit.id])[habit.id] == [(day(0), day(2))]
+    assert habit.stats.total_completions == 3
+    assert habit.streak_lock is None
+    assert habit.version == 3
+
+    habit.toggle_complete(START + timedelta(1))
+    assert sorted(Habit.get_streaks([habit.id])[habit.id]) == [(day(0), day(0)), (day(2), day(2))]
+    assert habit.stats.total_completions == 2
+    assert rollups(user) == {START: 1, START + timedelta(1): 0, START + timedelta(2): 1}
+
+
+def test_toggle_patches_cached_bitmap(habit):
+    habit.toggle_complete(START)
+    bitmap = habit.get_completion_bitmap()
+    habit.toggle_complete(START + timedelta(1))
+    assert completion_cache.get(habit.id) is bitmap
+    assert bitmap.version == habit.version == 2
+    assert habit.get_completion_status_range(START, START + timedelta(2)) == [
+        HabitStatus.COMPLETE, HabitStatus.COMPLETE, HabitStatus.INCOMPLETE
+    ]
+
+
+def test_bitmap_ranges():
+    dates = [START + timedelta(n) for n in range(21)]
+    bitmap = CompletionBitmap(START, 0, [(dates[0], dates[2]), (dates[9], dates[10])])
+    assert list(bitmap.streaks()) == [(dates[0], dates[2]), (dates[9], dates[10])]
+    bitmap.set_range(dates[1], dates[20], False)
+    bitmap[dates[12]] = True
+    # Dates before the first day and after the last bit are incomplete
+    assert bitmap.range(START - timedelta(1), dates[13]).nonzero()[0].tolist() == [1, 13]
+    copy = CompletionBitmap.from_array(START, 1, bitmap.range(START, dates[12]))
+    assert list(copy.streaks()) == [(dates[0], dates[0]), (dates[12], dates[12])]
+
+
+def test_bitmap_neighbours():
+    bitmap = CompletionBitmap(START, 0, [
+        (day(0).date(), day(1).date()), (day(3).date(), day(4).date())
+    ])
+    assert bitmap.neighbours(START + timedelta(1)) == ({"start": day(0), "end": day(1)}, None, None)
+    assert bitmap.neighbours(START + timedelta(2)) == (
+        None, {"start": day(0), "end": day(1)}, {"start": day(3), "end": day(4)}
+    )
+    assert bitmap.neighbours(START + timedelta(6)) == (None, None, None)
+    assert bitmap.longest() == 2
+    assert bitmap.latest() == {"start": day(3), "end": day(4)}
+
+
+def test_concurrent_toggles(habit, user, monkeypatch):
+    # mongomock finds and updates documents in several steps, while MongoDB updates each one atomically
+    write_lock = RLock()
+    for name in ("_find_and_modify", "_update"):
+        def atomic(*args, write=getattr(mongomock.collection.Collection, name), **kwargs):
+            with write_lock:
+                return write(*args, **kwargs)
+        monkeypatch.setattr(mongomock.collection.Collection, name, atomic)
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(
+            lambda n: Habit.objects.get(id=habit.id).toggle_complete(START + timedelta(n)), range(8)
+        ))
+    habit.reload()
+    assert Habit.get_streaks([habit.id])[habit.id] == [(day(0), day(7))]
+    assert habit.stats.total_completions == 8
+    assert habit.version == 8
+    assert rollups(user) == {START + timedelta(n): 1 for n in range(8)}
+
+
+def test_locked_habit_raises_conflict(habit, user, monkeypatch):
+    monkeypatch.setattr(documents, "STREAK_LOCK_WAIT", timedelta(seconds=0.05))
+    expiry = (datetime.utcnow() + timedelta(seconds=30)).replace(microsecond=0)
+    lock(habit, expiry)
+    with pytest.raises(StreakConflict):
+        habit.toggle_complete(START)
+    habit.reload()
+    assert habit.streak_lock == expiry
+    assert habit.version == 0
+    assert Habit.get_streaks([habit.id])[habit.id] == []
+    assert rollups(user) == {}
+
+
+def test_lock_is_waited_for(habit):
+    lock(habit, datetime.utcnow() + timedelta(seconds=0.2))
+    habit.toggle_complete(START)
+    assert habit.get_completion_status(START) == HabitStatus.COMPLETE
+
+
+def test_expired_lock_is_taken(habit):
+    lock(habit, datetime.utcnow() - timedelta(seconds=1))
+    habit.toggle_complete(START)
+    habit.reload()
+    assert habit.streak_lock is None
+    assert Habit.get_streaks([habit.id])[habit.id] == [(day(0), day(0))]
+
+
+def test_deleted_habit_can_not_be_locked(habit, monkeypatch):
+    monkeypatch.setattr(documents, "STREAK_LOCK_WAIT", timedelta(0))
+    Habit.objects(id=habit.id).delete()
+    with pytest.raises(Habit.DoesNotExist):
+        habit.toggle_complete(START)
+
+
+def test_streaks_are_not_written_near_lock_expiry(habit, user, monkeypatch):
+    if habit.streak_storage == "embedded":
+        pytest.skip("Embedded streaks are saved with the lock")
+    monkeypatch.setattr(documents, "STREAK_LOCK_MARGIN", documents.STREAK_LOCK_TIMEOUT)
+    with pytest.raises(StreakConflict):
+        habit.toggle_complete(START)
+    habit.reload()
+    assert habit.streak_lock is None
+    assert habit.stats is None
+    assert Habit.get_streaks([habit.id])[habit.id] == []
+    assert rollups(user) == {}
+
+
+def test_streaks_changed_by_another_process(habit, storage):
+    if storage == "embedded":
+        pytest.skip("Embedded streaks can only be changed while holding the lock")
+    habit.toggle_complete(START)
+    # Another process extends the streak without the lock, so the cached index is out of date
+    HabitStreak.objects(habit=habit.id).update_one(set__end=day(1))
+    with pytest.raises(StreakConflict):
+        habit.toggle_complete(START + timedelta(1))
+    habit.reload()
+    assert habit.streak_lock is None
+    assert habit.stats is None
+    assert Habit.get_streaks([habit.id])[habit.id] == [(day(0), day(1))]
+
+
+def test_embedded_streaks_are_lost_if_lock_is_taken(habit, user, storage):
+    if storage == "collection":
+        pytest.skip("HabitStreaks are written before the lock is released")
+    with pytest.raises(StreakConflict):
+        with habit._streak_lock() as update:
+            update.changes[START] = True
+            update.set_intervals([[day(0), day(0)]])
+            lock(habit, datetime.utcnow() + timedelta(seconds=30))
+    habit.reload()
+    assert habit.streak_intervals == []
+    assert rollups(user) == {}
+
+
+def test_compact_streaks(habit):
+    add_streaks(habit, [(day(0), day(1)), (day(2), day(2)), (day(1), day(3)), (day(5), day(5))])
+    raw_habits = Habit.objects(id=habit.id).only("user").as_pymongo()
+    assert Habit.compact_streaks(raw_habits) == ({habit.id: (4, 2)}, [])
+    assert len(Habit.get_streaks([habit.id])[habit.id]) == 4
+
+    assert Habit.compact_streaks(raw_habits, repair=True) == ({habit.id: (4, 2)}, [])
+    habit.reload()
+    assert sorted(Habit.get_streaks([habit.id])[habit.id]) == [(day(0), day(3)), (day(5), day(5))]
+    assert habit.stats.total_completions == 5
+    assert habit.version == 1
+    assert habit.year_versions == {}
+    assert habit.streak_lock is None
+    assert Habit.compact_streaks(raw_habits, repair=True) == ({}, [])
+
+
+def test_compact_streaks_skips_locked_habits(habit):
+    add_streaks(habit, [(day(0), day(0)), (day(1), day(1))])
+    lock(habit, datetime.utcnow() + timedelta(seconds=30))
+    raw_habits = list(Habit.objects(id=habit.id).only("user").as_pymongo())
+    assert Habit.compact_streaks(raw_habits, repair=True) == ({}, raw_habits)
+    assert len(Habit.get_streaks([habit.id])[habit.id]) == 2
+
+
+def test_streaks_command(app, habit):
+    add_streaks(habit, [(day(0), day(0)), (day(1), day(1))])
+    runner = app.test_cli_runner()
+    result = runner.invoke(streaks_command, [])
+    assert "user@example.com read-0: 2 streaks can be merged into 1" in result.output
+    result = runner.invoke(streaks_command, ["--repair"])
+    assert "user@example.com read-0: 2 streaks merged into 1" in result.output
+    result = runner.invoke(streaks_command, [])
+    assert "Checked 1 habits, 0 with streaks that overlap or touch." in result.output
+
+
+def test_move_streaks(habit):
+    HabitStreak._get_collection().insert_one(
+        HabitStreak.new_raw(habit.id, habit.user_id, day(0), day(1))
+    )
+    Habit.objects(id=habit.id).update_one(set__streak_intervals=[[day(2), day(2)], [day(5), day(5)]])
+    habit.reload()
+    assert habit.move_streaks("embedded") == 2
+    habit.reload()
+    assert habit.streak_intervals == [[day(0), day(2)], [day(5), day(5)]]
+    assert HabitStreak.objects(habit=habit.id).count() == 0
+
+    assert habit.move_streaks("collection") == 2
+    habit.reload()
+    assert habit.streak_intervals == []
+    streaks = HabitStreak.objects(habit=habit.id).only("start", "end").as_pymongo()
+    assert sorted((streak["start"], streak["end"]) for streak in streaks) == [
+        (day(0), day(2)), (day(5), day(5))
+    ]
+
+
+def test_api_conflict_returns_json(client, habit, monkeypatch):
+    monkeypatch.setattr(documents, "STREAK_LOCK_WAIT", timedelta(0))
+    lock(habit, datetime.utcnow() + timedelta(seconds=30))
+    update = {"slug": "read-0", "date": "2024-01-01", "complete": True}
+    response = client.post("/api/checklist", json={"updates": [update]})
+    assert response.status_code == 409
+    assert "changed somewhere else" in response.get_json()["error"]
+
+
+def test_imports_through_stale_copies(habit, user):
+    stale_habit = Habit.objects.get(id=habit.id)
+    habit.add_completions(CompletionBitmap(day(-10).date(), 0, [(day(-10).date(), day(-9).date())]))
+    # The stale copy still has the old creation date, which must not be moved forward again
+    stale_habit.add_completions(CompletionBitmap(day(-3).date(), 0, [(day(-3).date(), day(-3).date())]))
+    assert stale_habit.date_created == day(-10)
+    habit.reload()
+    assert habit.date_created == day(-10)
+    assert sorted(Habit.get_streaks([habit.id])[habit.id]) == [(day(-10), day(-9)), (day(-3), day(-3))]
+    assert habit.stats.total_completions == 3
+
+
+def test_set_incomplete_through_stale_copy(habit):
+    stale_habit = Habit.objects.get(id=habit.id)
+    habit.set_complete(START)
+    stale_habit.set_incomplete(START)
+    assert Habit.get_streaks([habit.id])[habit.id] == []
+    stale_habit.set_complete(START + timedelta(1))
+    habit.set_complete(START + timedelta(1))
+    assert Habit.get_streaks([habit.id])[habit.id] == [(day(1), day(1))]
+    assert Habit.objects.get(id=habit.id).stats.total_completions == 1
@@ -0,0 +1,128 @@
+import json
+import pytest
+from datetime import date, datetime
+from threading import BoundedSemaphore
+from habit_tracker import bcrypt, password_hasher
+from habit_tracker.documents import DailyRollup, Habit, HabitStreak, User
+from habit_tracker.habits.history import export_history
+from tests.conftest import PASSWORD
+
+
+def change_password(client, current_password, new_password):
+    return client.post("/account", data={
+        "current_password": current_password,
+        "new_password": new_password,
+        "confirm_new_password": new_password,
+        "submit_password": "Update Password"
+    })
+
+
+def test_delete_account_logs_out(client, user):
+    client.post("/delete_account")
+    response = client.get("/account")
+    assert response.status_code == 302
+    assert "/login" in response.location
+    assert User.objects(id=user.id).count() == 0
+
+
+@pytest.mark.parametrize("async_deletion", [False, True])
+def test_delete_account_deletes_history(app, client, user, monkeypatch, async_deletion):
+    monkeypatch.setitem(app.config, "ASYNC_DELETION", async_deletion)
+    for name in ("Read", "Walk"):
+        habit = Habit(name=name, user=user, date_created=datetime(2024, 1, 1))
+        habit.save()
+        habit.set_complete(date(2024, 1, 2))
+    response = client.post("/delete_account")
+    assert User.objects(id=user.id).count() == 0
+    # Deferred deletion runs once the response has been sent
+    assert Habit.objects(user=user.id).count() == (2 if async_deletion else 0)
+    response.close()
+    for document in (Habit, HabitStreak, DailyRollup):
+        assert document.objects(user=user.id).count() == 0
+
+
+def test_user_deleted_by_another_process(client, user):
+    # Caches the user in this process
+    assert client.get("/account").status_code == 200
+    User._get_collection().delete_one({"_id": user.id})
+    response = client.post("/my_habits/", data={"name": "Read"})
+    assert response.status_code == 302
+    assert "/login" in response.location
+    assert Habit.objects(user=user.id).count() == 0
+
+
+def test_password_changed_by_another_process(client, user):
+    assert client.get("/account").status_code == 200
+    User.objects(id=user.id).update_one(set__password=password_hasher.generate_password_hash("changed"))
+    response = change_password(client, "changed", "new password")
+    assert response.status_code == 302
+    user.reload()
+    assert password_hasher.check_password_hash(user.password, "new password")
+
+
+def test_password_change_uncaches_user(client, user):
+    assert client.get("/account").status_code == 200
+    change_password(client, PASSWORD, "new password")
+    # The account page checks the current password against the user loaded for the request
+    response = change_password(client, "new password", "newer password")
+    assert response.status_code == 302
+    user.reload()
+    assert password_hasher.check_password_hash(user.password, "newer password")
+
+
+def test_export_is_streamed(client, user):
+    habit = Habit(name="Read", user=user, date_created=datetime(2024, 1, 1))
+    habit.save()
+    for day in (2, 3, 5):
+        habit.set_complete(date(2024, 1, day))
+
+    response = client.get("/account/export?format=csv")
+    assert response.is_streamed
+    assert response.headers["Content-Disposition"] == "attachment; filename=habit_history.csv"
+    assert response.get_data(as_text=True).splitlines() == [
+        "type,habit,slug,date_created,active,start,end,streak_length",
+        "habit,Read,read-0,2024-01-01,True,,,",
+        "streak,Read,,,,2024-01-02,2024-01-03,2",
+        "streak,Read,,,,2024-01-05,2024-01-05,1"
+    ]
+
+    response = client.get("/account/export?format=jsonl&daily=1")
+    assert response.is_streamed
+    assert response.headers["Content-Disposition"] == "attachment; filename=habit_history_daily.jsonl"
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert rows == [{"habit": "Read", "date": f"2024-01-0{day}"} for day in (2, 3, 5)]
+    chunks = list(export_history(user.id, "csv", daily=True, batch_size=2))
+    assert chunks == ["habit,date\nRead,2024-01-02\nRead,2024-01-03\n", "Read,2024-01-05\n"]
+
+    assert client.get("/account/export?format=xml").status_code == 400
+
+
+def login(app):
+    return app.test_client().post("/login", data={"email": "user@example.com", "password": PASSWORD})
+
+
+def test_login_rehashes_old_password(app, user):
+    old_hash = bcrypt.generate_password_hash(PASSWORD, 5).decode("utf-8")
+    User.objects(id=user.id).update_one(set__password=old_hash)
+    assert password_hasher.needs_rehash(old_hash)
+    response = login(app)
+    assert response.status_code == 302
+    assert "password_check;dur=" in response.headers["Server-Timing"]
+    # The hash is replaced once the response has been sent
+    response.close()
+    user.reload()
+    assert not password_hasher.needs_rehash(user.password)
+    assert password_hasher.check_password_hash(user.password, PASSWORD)
+
+
+def test_busy_password_hasher_returns_503(app, user, monkeypatch):
+    slots = BoundedSemaphore(1)
+    slots.acquire()
+    monkeypatch.setattr(password_hasher, "_slots", slots)
+    monkeypatch.setattr(password_hasher, "timeout", 0.01)
+    rejected = password_hasher.stats()["rejected"]
+    assert login(app).status_code == 503
+    assert password_hasher.stats()["rejected"] == rejected + 1
+
+    slots.release()
+    assert login(app).status_code == 302